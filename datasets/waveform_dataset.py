@@ -19,6 +19,7 @@ waveform data set.
 """
 
 import numpy as np
+import tensorflow as tf
 from audio_synthesis.utils import spectral
 
 # CLIP_NUMBER_STD is defined in the original implementation of SpecGAN
@@ -42,6 +43,43 @@ def get_waveform_dataset(path):
     dataset = np.load(path)['arr_0']
     return dataset
 
+def get_waveform_tfrecord_dataset(pattern, chunk_length, conditioning_length=None):
+    """Loads the waveform dataset from TFRecord shards as a tf.data pipeline.
+
+    The shards are read in parallel, so the data set is never
+    fully loaded into memory.
+
+    Args:
+        pattern: A glob pattern matching the TFRecord shards. Each
+            record is expected to hold a single waveform chunk
+            as the float feature 'audio', and optionally its
+            conditioning as the float feature 'conditioning'.
+        chunk_length: The length of each waveform chunk.
+        conditioning_length: The length of the conditioning stored
+            with each chunk. If None, the conditioning is not loaded.
+
+    Returns:
+        An un-batched tf.data.Dataset of waveform chunks, or of
+        (waveform chunk, conditioning) pairs if conditioning_length
+        is given.
+    """
+
+    features = {'audio': tf.io.FixedLenFeature([chunk_length], tf.float32)}
+    if conditioning_length:
+        features['conditioning'] = tf.io.FixedLenFeature([conditioning_length], tf.float32)
+
+    def parse(record):
+        example = tf.io.parse_single_example(record, features)
+        if conditioning_length:
+            return example['audio'], example['conditioning']
+        return example['audio']
+
+    shards = tf.data.Dataset.list_files(pattern)
+    records = shards.interleave(
+        tf.data.TFRecordDataset, cycle_length=8, num_parallel_calls=tf.data.AUTOTUNE
+    )
+    return records.map(parse, num_parallel_calls=tf.data.AUTOTUNE)
+
 def _get_pre_processed_dataset(path, pre_process_fn):
     """Handles efficiently pre-processing the dataset.
     Args:
@@ -113,6 +151,39 @@ def get_stft_dataset(path, frame_length=512, frame_step=128):
 
     return processed_dataset
 
+def get_streaming_stft_dataset(path, frame_length=512, frame_step=128, chunk_length=2**14):
+    """Loads the STFT representation of the dataset as a tf.data pipeline.
+
+    Unlike get_stft_dataset, the STFTs are computed on the fly as elements
+    are requested, so the full STFT dataset is never held in memory.
+
+    Args:
+        path: The path to the .npz file containing
+            the dataset, or a glob pattern matching
+            TFRecord shards.
+        frame_length (samples): Length of the FFT windows.
+        frame_step (samples): The shift in time after each
+            FFT window.
+        chunk_length (samples): The length of each waveform
+            chunk, only used when loading TFRecord shards.
+    Returns:
+        An un-batched tf.data.Dataset of STFTs, each with shape
+        [time_bins, frequency, 2].
+    """
+
+    if path.endswith('.npz'):
+        waveforms = tf.data.Dataset.from_tensor_slices(get_waveform_dataset(path))
+    else:
+        waveforms = get_waveform_tfrecord_dataset(path, chunk_length)
+
+    process_stft = lambda x: spectral.waveform_2_stft(
+        x,
+        frame_length=frame_length,
+        frame_step=frame_step
+    )[0]
+
+    return waveforms.map(process_stft, num_parallel_calls=tf.data.AUTOTUNE)
+
 def _get_spectogram_normalizing_constants(spectogram_data):
     """Computes the spectral normalizing constants for a waveform dataset.
 
@@ -36,13 +36,13 @@ SAMPLE_RATE = 16000
 FFT_FRAME_LENGTH = 512
 FFT_FRAME_STEP = 128
 SIGNAL_LENGTH = 2**14
+CONDITIONING_LENGTH = 2**13
 WAVEFORM_SHAPE = [-1, SIGNAL_LENGTH, 1]
 MAGNITUDE_IMAGE_SHAPE = [-1, 128, 256, 1]
 CRITIC_WEIGHTINGS = [1.0, 1.0/1000.0]
 CHECKPOINT_DIR = '_results/conditioning/LSC_WaveSpecGAN_HR_8192/training_checkpoints/'
 RESULT_DIR = '_results/conditioning/LSC_WaveSpecGAN_HR_8192/audio/'
-MAESTRO_PATH = 'data/MAESTRO_ls_6h.npz'
-MAESTRO_CONDITIONING_PATH = 'data/MAESTRO_ls_hlf_cond_6h.npz'
+MAESTRO_PATH = 'data/MAESTRO_ls_6h-*.tfrecord'
 
 def _get_discriminator_input_representations(x_in):
     """Computes the input representations for the WaveSpecGAN discriminator models,
@@ -64,8 +64,11 @@ def _get_discriminator_input_representations(x_in):
     return (x_in, magnitude)
 
 def main():
-    raw_maestro = waveform_dataset.get_waveform_dataset(MAESTRO_PATH)
-    raw_maestro_conditioning = waveform_dataset.get_waveform_dataset(MAESTRO_CONDITIONING_PATH)
+    # Each data point is stored with its conditioning, so the pairs
+    # are streamed from the shards rather than loaded into memory.
+    raw_maestro = waveform_dataset.get_waveform_tfrecord_dataset(
+        MAESTRO_PATH, SIGNAL_LENGTH, conditioning_length=CONDITIONING_LENGTH
+    )
 
     generator = ls_conditional_wave_spec_gan.Generator()
     discriminator = ls_conditional_wave_spec_gan.WaveformDiscriminator(
@@ -86,7 +89,7 @@ def main():
         )
 
     wave_gan_model = conditional_wgan.ConditionalWGAN(
-        raw_maestro, raw_maestro_conditioning, generator, [discriminator, spec_discriminator],
+        raw_maestro, None, generator, [discriminator, spec_discriminator],
         Z_DIM, generator_optimizer, discriminator_optimizer,
         discriminator_training_ratio=D_UPDATES_PER_G, batch_size=BATCH_SIZE, epochs=EPOCHS,
         checkpoint_dir=CHECKPOINT_DIR, fn_save_examples=save_examples,
@@ -34,16 +34,20 @@ RESULT_DIR = '_results/representation_study/SpeechMNIST/WaveGAN/audio/'
 DATASET_PATH = 'data/SpeechMNIST_1850.npz'
 
 def main():
-    os.environ['CUDA_VISIBLE_DEVICES'] = '1'
+    # Defaults to a single GPU. Set CUDA_VISIBLE_DEVICES to several GPUs
+    # for the MirroredStrategy to split each batch across them.
+    os.environ.setdefault('CUDA_VISIBLE_DEVICES', '1')
     print('Num GPUs Available: ', len(tf.config.experimental.list_physical_devices('GPU')))
 
     raw_dataset = waveform_dataset.get_waveform_dataset(DATASET_PATH)
 
-    generator = wave_gan.Generator()
-    discriminator = wave_gan.Discriminator(input_shape=WAVEFORM_SHAPE)
+    strategy = tf.distribute.MirroredStrategy()
+    with strategy.scope():
+        generator = wave_gan.Generator()
+        discriminator = wave_gan.Discriminator(input_shape=WAVEFORM_SHAPE)
 
-    generator_optimizer = tf.keras.optimizers.Adam(1e-4, beta_1=0.5, beta_2=0.9)
-    discriminator_optimizer = tf.keras.optimizers.Adam(1e-4, beta_1=0.5, beta_2=0.9)
+        generator_optimizer = tf.keras.optimizers.Adam(1e-4, beta_1=0.5, beta_2=0.9)
+        discriminator_optimizer = tf.keras.optimizers.Adam(1e-4, beta_1=0.5, beta_2=0.9)
 
     get_waveform = lambda waveform: waveform
 
@@ -56,7 +60,7 @@ def main():
         raw_dataset, generator, [discriminator], Z_DIM, generator_optimizer,
         discriminator_optimizer, discriminator_training_ratio=D_UPDATES_PER_G,
         batch_size=BATCH_SIZE, epochs=EPOCHS, checkpoint_dir=CHECKPOINT_DIR,
-        fn_save_examples=save_examples
+        fn_save_examples=save_examples, strategy=strategy
     )
 
     wave_gan_model.restore('ckpt-180', 1800)
@@ -21,42 +21,46 @@ from audio_synthesis.models import wgan
 
 SHUFFLE_BUFFER_SIZE = 300
 
-def _compute_losses(discriminator, d_real, d_fake, interpolated_x, interpolated_c):
+def _compute_discriminator_loss(d_real, d_fake, interpolation_gradient_x,
+                                interpolation_gradient_c):
     """Base implementation of the function that computes the WGAN
-    generator and disciminator losses.
+    disciminator loss.
 
     Args:
-        discriminator: The discriminator function.
         d_real: The discriminator score for the real data points.
         d_fake: The discriminator score for the fake data points.
-        interpolated_x: The interpolation between the real and fake
-            data points.
-        interpolated_c: The interpolation between the real and fake
-            conditioning.
+        interpolation_gradient_x: The gradient of the discriminator
+            score with respect to the interpolation between the real
+            and fake data points.
+        interpolation_gradient_c: The gradient of the discriminator
+            score with respect to the interpolation between the real
+            and fake conditioning.
 
     Returns:
-        g_loss: The loss for the generator function.
-        d_loss: The loss for the discriminator function.
+        The loss for the discriminator function.
     """
     wasserstein_distance = tf.reduce_mean(d_real) - tf.reduce_mean(d_fake)
 
-    gradient_penalty_x = wgan.compute_gradient_penalty(
-        lambda interpolated: discriminator(interpolated, interpolated_c),
-        interpolated_x
-    )
-    
-    gradient_penalty_c = wgan.compute_gradient_penalty(
-        lambda interpolated: discriminator(interpolated_x, interpolated),
-        interpolated_c
-    )
+    gradient_penalty_x = wgan.compute_slope_penalty(interpolation_gradient_x)
+    gradient_penalty_c = wgan.compute_slope_penalty(interpolation_gradient_c)
 
-    g_loss = tf.reduce_mean(d_fake)
-    d_loss = wasserstein_distance + (
+    return wasserstein_distance + (
         wgan.GRADIENT_PENALTY_LAMBDA * gradient_penalty_x +
         wgan.GRADIENT_PENALTY_LAMBDA * gradient_penalty_c
     )
 
-    return g_loss, d_loss
+def _compute_generator_loss(d_fake):
+    """Base implementation of the function that computes the WGAN
+    generator loss.
+
+    Args:
+        d_fake: The discriminator score for the fake data points.
+
+    Returns:
+        The loss for the generator function.
+    """
+
+    return tf.reduce_mean(d_fake)
 
 class ConditionalWGAN(wgan.WGAN): # pylint: disable=too-many-instance-attributes
     """Implements the training procedure for Wasserstein GAN [1] with Gradient Penalty [2] in
@@ -73,16 +77,18 @@ class ConditionalWGAN(wgan.WGAN): # pylint: disable=too-many-instance-attributes
     def __init__(self, raw_dataset, raw_conditioning_dataset, generator,
                  discriminator, z_dim, generator_optimizer, discriminator_optimizer,
                  discriminator_training_ratio=5, batch_size=64, epochs=1, checkpoint_dir=None,
-                 epochs_per_save=10, fn_compute_loss=_compute_losses,
+                 epochs_per_save=10, fn_compute_loss=_compute_discriminator_loss,
                  fn_get_discriminator_input_representations=wgan.get_representations,
-                 fn_save_examples=None):
+                 fn_save_examples=None, strategy=None,
+                 fn_compute_generator_loss=_compute_generator_loss):
         """Initilizes the WGAN class.
 
         Paramaters:
-            raw_dataset: A numpy array containing the training dataset.
+            raw_dataset: A numpy array containing the training dataset, or an
+                (un-batched) tf.data.Dataset of (data, conditioning) pairs.
             raw_conditioning_dataset: A numpy array containing the conditioning information.
                 Should be aligned with raw_dataset, and contain the same number of
-                elements.
+                elements. Ignored if raw_dataset is a tf.data.Dataset.
             generator: The generator model.
             discriminator: A list of discriminator models. If only one 
                 discriminator then a singleton list should be given.
@@ -96,89 +102,154 @@ class ConditionalWGAN(wgan.WGAN): # pylint: disable=too-many-instance-attributes
             checkpoint_dir: Directory in which the model weights are saved. If
                     None, then the model is not saved.
             epochs_per_save: How often the model weights are saved.
-            fn_compute_loss: The function that computes the generator and
-                    discriminator loss. Must have signature
-                    f(model, d_real, d_fake, interpolated).
+            fn_compute_loss: The function that computes the discriminator
+                    loss. Must have signature
+                    f(d_real, d_fake, interpolation_gradient_x,
+                    interpolation_gradient_c).
             fn_get_discriminator_input_representations: A function that takes
                 a data point (real and fake) and produces a list of representations,
                 one for each discriminator. Default is an identity function.
                 Signature expected is f(x_in), result should be an N element list
                 of representations.
             fn_save_examples: A function to save generations and real data,
-                    called after every epoch.
+                    called after every epoch. If it returns a
+                    concurrent.futures.Future, the save is waited on
+                    before the next one, and at the end of training.
+            strategy: The tf.distribute strategy used for training. The models
+                    and optimizers must be created under strategy.scope(). If
+                    None, the default (single device) strategy is used.
+            fn_compute_generator_loss: The function that computes the generator
+                    loss. Must have signature f(d_fake).
         """
 
+        if isinstance(raw_dataset, tf.data.Dataset):
+            joint_dataset = raw_dataset
+            raw_conditioning_dataset = raw_dataset.map(lambda x, c: c)
+        else:
+            joint_dataset = tf.data.Dataset.from_tensor_slices(
+                (raw_dataset, raw_conditioning_dataset))
+
         super(ConditionalWGAN, self).__init__(
             raw_conditioning_dataset, generator, discriminator, z_dim,
             generator_optimizer, discriminator_optimizer, discriminator_training_ratio,
             batch_size, epochs, checkpoint_dir, epochs_per_save, fn_compute_loss,
-            fn_get_discriminator_input_representations, fn_save_examples
+            fn_get_discriminator_input_representations, fn_save_examples,
+            strategy, fn_compute_generator_loss
         )
         self.raw_x_dataset = raw_dataset
         
-        self.conditioned_dataset = tf.data.Dataset.from_tensor_slices(
-            (raw_dataset, raw_conditioning_dataset)).shuffle(
-            self.buffer_size).repeat(self.discriminator_training_ratio).batch(
-            self.batch_size, drop_remainder=False)
+        self.conditioned_dataset = joint_dataset.shuffle(
+            self.buffer_size, reshuffle_each_iteration=True).batch(
+            self.batch_size, drop_remainder=True)
 
-    def _train_step(self, data_in, train_generator=True, train_discriminator=True):
-        """Executes one training step of the WGAN model.
+    def _train_discriminator(self, data_in, seed): # pylint: disable=too-many-locals
+        """Executes one update of the discriminator weights.
 
-        Paramaters:
+        Args:
             data_in: One batch of training data. Has the form ((x_in, c_in), c_gen_in).
                 Where (x_in, c_in) is jointly sampled and c_gen_in is sampled from the
                 conditional margional.
-            train_generator: If true, the generator weights will be updated.
-            train_discriminator: If true, the discriminator weights will be updated.
+            seed: The seed (shape [2]) for the random ops in this update.
         """
 
         xc_in, c_gen_in = data_in
         x_in, c_in = xc_in
-        
-        x_in_representations = self.fn_get_discriminator_input_representations(x_in)
-
-        with tf.GradientTape() as gen_tape:
-            g_loss = 0
 
-            z_in = tf.random.uniform((x_in.shape[0], self.z_dim), -1, 1)
-            x_gen = self.generator(z_in, c_gen_in, training=True)
-            x_gen_representations = self.fn_get_discriminator_input_representations(x_gen)
+        seeds = tf.unstack(
+            tf.random.experimental.stateless_split(seed, num=2 * len(self.discriminator) + 1)
+        )
 
-            for i in range(len(self.discriminator)):
-                with tf.GradientTape() as disc_tape:
-                    d_real = self.discriminator[i](
-                        x_in_representations[i], c_in, training=True
-                    )
-                    d_fake = self.discriminator[i](
-                        x_gen_representations[i], c_gen_in, training=True
+        x_in_representations = self.fn_get_discriminator_input_representations(x_in)
+        z_in = tf.random.stateless_uniform((tf.shape(x_in)[0], self.z_dim), seeds[0], -1, 1)
+
+        # The generator is not updated, so no gradient is
+        # taken through it.
+        x_gen = tf.stop_gradient(self.generator(z_in, c_gen_in, training=True))
+        x_gen_representations = self.fn_get_discriminator_input_representations(x_gen)
+
+        with tf.GradientTape() as disc_tape:
+            d_losses = []
+            for i, discriminator in enumerate(self.discriminator):
+                x_interpolation = wgan.get_interpolation(
+                    x_in_representations[i], x_gen_representations[i], seeds[2 * i + 1]
+                )
+                c_interpolation = wgan.get_interpolation(c_in, c_gen_in, seeds[2 * i + 2])
+
+                # Score the real, fake and interpolated data in a
+                # single forward pass of the discriminator.
+                with tf.GradientTape() as interpolation_tape:
+                    interpolation_tape.watch([x_interpolation, c_interpolation])
+                    d_all = discriminator(
+                        tf.concat([
+                            x_in_representations[i], x_gen_representations[i],
+                            x_interpolation
+                        ], axis=0),
+                        tf.concat([c_in, c_gen_in, c_interpolation], axis=0),
+                        training=True
                     )
+                    d_real, d_fake, d_interpolated = tf.split(d_all, 3, axis=0)
 
-                    x_interpolation = wgan.get_interpolation(
-                        x_in_representations[i], x_gen_representations[i]
+                interpolation_gradient_x, interpolation_gradient_c = \
+                    interpolation_tape.gradient(
+                        d_interpolated, [x_interpolation, c_interpolation]
                     )
-                    c_interpolation = wgan.get_interpolation(c_in, c_gen_in)
 
-                    g_loss_i, d_loss_i = self.fn_compute_loss(
-                        self.discriminator[i], d_real, d_fake, x_interpolation, c_interpolation
-                    )
+                d_losses.append(self.fn_compute_loss(
+                    d_real, d_fake, interpolation_gradient_x, interpolation_gradient_c
+                ))
+
+            # The discriminators share no weights, so the gradient of
+            # the summed losses is each discriminator's own gradient.
+            # Gradients are summed across replicas, so the losses are
+            # scaled to give the mean over the global batch.
+            d_loss = tf.add_n(d_losses) / self.strategy.num_replicas_in_sync
+            d_loss = wgan.get_scaled_loss(self.discriminator_optimizer, d_loss)
+
+        discriminator_variables = [
+            variable for discriminator in self.discriminator
+            for variable in discriminator.trainable_variables
+        ]
+        gradients_of_discriminator = disc_tape.gradient(d_loss, discriminator_variables)
+        gradients_of_discriminator = wgan.get_unscaled_gradients(
+            self.discriminator_optimizer, gradients_of_discriminator
+        )
+        self.discriminator_optimizer.apply_gradients(
+            zip(gradients_of_discriminator, discriminator_variables)
+        )
 
-                g_loss += self.discriminator[i].weighting * g_loss_i
+    def _train_generator(self, data_in, seed):
+        """Executes one update of the generator weights.
 
-                if train_discriminator:
-                    gradients_of_discriminator = disc_tape.gradient(
-                        d_loss_i, self.discriminator[i].trainable_variables
-                    )
-                    self.discriminator_optimizer.apply_gradients(
-                        zip(gradients_of_discriminator, self.discriminator[i].trainable_variables)
-                    )
+        Args:
+            data_in: One batch of training data, see _train_discriminator.
+                Only the conditioning for the generations, c_gen_in, is used.
+            seed: The seed (shape [2]) for the random ops in this update.
+        """
+
+        _, c_gen_in = data_in
+        z_in = tf.random.stateless_uniform((tf.shape(c_gen_in)[0], self.z_dim), seed, -1, 1)
+
+        with tf.GradientTape() as gen_tape:
+            x_gen = self.generator(z_in, c_gen_in, training=True)
+            x_gen_representations = self.fn_get_discriminator_input_representations(x_gen)
+
+            g_losses = [
+                self.fn_compute_generator_loss(discriminator(x_fake, c_gen_in, training=True))
+                for discriminator, x_fake in zip(self.discriminator, x_gen_representations)
+            ]
+
+            weightings = [discriminator.weighting for discriminator in self.discriminator]
+            g_loss = tf.reduce_sum(tf.stack(weightings) * tf.stack(g_losses))
+            g_loss /= self.strategy.num_replicas_in_sync
+            g_loss = wgan.get_scaled_loss(self.generator_optimizer, g_loss)
 
-        if train_generator:
-            gradients_of_generator = gen_tape.gradient(
-                g_loss, self.generator.trainable_variables
-            )
-            self.generator_optimizer.apply_gradients(
-                zip(gradients_of_generator, self.generator.trainable_variables)
-            )
+        gradients_of_generator = gen_tape.gradient(g_loss, self.generator.trainable_variables)
+        gradients_of_generator = wgan.get_unscaled_gradients(
+            self.generator_optimizer, gradients_of_generator
+        )
+        self.generator_optimizer.apply_gradients(
+            zip(gradients_of_generator, self.generator.trainable_variables)
+        )
 
     def _get_training_dataset(self):
         """Function gives the dataset to use during training.
@@ -198,12 +269,26 @@ class ConditionalWGAN(wgan.WGAN): # pylint: disable=too-many-instance-attributes
         Args:
             epoch: The current epoch, added as a post-fix of the file
                 name.
+
+        Returns:
+            The value returned by fn_save_examples, or None if
+            no examples are saved.
         """
 
         if self.fn_save_examples:
             z_in = tf.random.uniform((self.batch_size, self.z_dim), -1, 1)
-            x_save = self.raw_x_dataset[0:self.batch_size]
-            c_save = self.raw_dataset[0:self.batch_size]
-
-            generations = tf.squeeze(self.generator(z_in, c_save, training=False))
-            self.fn_save_examples(epoch, x_save, generations)
+            if isinstance(self.raw_x_dataset, tf.data.Dataset):
+                x_save, c_save = next(iter(self.raw_x_dataset.take(self.batch_size).batch(
+                    self.batch_size)))
+                x_save = x_save.numpy()
+            else:
+                x_save = self.raw_x_dataset[0:self.batch_size]
+                c_save = self.raw_dataset[0:self.batch_size]
+
+            # The generator may be built by this call, so its weights
+            # must be created under the distribution strategy.
+            with self.strategy.scope():
+                generations = tf.squeeze(self.generator(z_in, c_save, training=False))
+            return self.fn_save_examples(epoch, x_save, generations)
+
+        return None
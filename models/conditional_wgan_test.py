@@ -0,0 +1,78 @@
+# Lint as: python3
+"""Tests for the conditional WGAN model."""
+
+import os
+import tensorflow as tf
+import numpy as np
+
+import conditional_wgan
+
+Z_DIM = 4
+DATA_LENGTH = 16
+CONDITIONING_LENGTH = 3
+
+
+class _Generator(tf.keras.Model):
+
+    def __init__(self):
+        super(_Generator, self).__init__()
+        self.dense = tf.keras.layers.Dense(DATA_LENGTH)
+        self.out = tf.keras.layers.Activation('linear', dtype='float32')
+
+    def call(self, z_in, c_in, training=False):
+        return self.out(self.dense(tf.concat([z_in, tf.cast(c_in, z_in.dtype)], axis=-1)))
+
+
+class _Discriminator(tf.keras.Model):
+
+    def __init__(self):
+        super(_Discriminator, self).__init__()
+        self.weighting = 1.0
+        self.hidden = tf.keras.layers.Dense(8, activation=tf.nn.leaky_relu)
+        self.out = tf.keras.layers.Dense(1, dtype='float32')
+
+    def call(self, x_in, c_in, training=False):
+        return self.out(self.hidden(tf.concat([x_in, tf.cast(c_in, x_in.dtype)], axis=-1)))
+
+
+class ConditionalWGANTest(tf.test.TestCase):
+
+    def tearDown(self):
+        tf.keras.mixed_precision.set_global_policy('float32')
+        super(ConditionalWGANTest, self).tearDown()
+
+    def test_train_mixed_float16(self):
+        tf.keras.mixed_precision.set_global_policy('mixed_float16')
+
+        data = np.random.normal(size=(64, DATA_LENGTH)).astype(np.float32)
+        conditioning = np.random.normal(size=(64, CONDITIONING_LENGTH)).astype(np.float32)
+        generator = _Generator()
+        discriminator = _Discriminator()
+        generator(tf.zeros((1, Z_DIM)), tf.zeros((1, CONDITIONING_LENGTH)))
+        initial_generator_weights = generator.get_weights()
+
+        # Without loss scaling, the gradients of this small loss
+        # underflow in float16 and the generator is never updated.
+        model = conditional_wgan.ConditionalWGAN(
+            data, conditioning, generator, [discriminator], Z_DIM,
+            tf.keras.optimizers.legacy.Adam(1e-4), tf.keras.optimizers.legacy.Adam(1e-4),
+            discriminator_training_ratio=1, batch_size=16,
+            checkpoint_dir=self.get_temp_dir(),
+            fn_compute_generator_loss=lambda d_fake: 1e-7 * tf.reduce_mean(d_fake)
+        )
+        model.train()
+
+        self.assertIsInstance(
+            model.generator_optimizer, tf.keras.mixed_precision.LossScaleOptimizer
+        )
+        self.assertEqual(4, model.generator_optimizer.iterations.numpy())
+        self.assertEqual(4, model.discriminator_optimizer.iterations.numpy())
+        self.assertNotAllClose(initial_generator_weights[0], generator.get_weights()[0])
+        for variable in generator.trainable_variables + discriminator.trainable_variables:
+            self.assertAllEqual(
+                tf.ones_like(variable, tf.bool), tf.math.is_finite(variable)
+            )
+
+if __name__ == '__main__':
+    os.environ["CUDA_VISIBLE_DEVICES"] = ''
+    tf.test.main()
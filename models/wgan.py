@@ -18,65 +18,122 @@ with Gradient Penalty [https://arxiv.org/abs/1704.00028].
 
 import time
 import os
+from concurrent.futures import Future
+import numpy as np
 import tensorflow as tf
 from tensorflow.keras import utils as keras_utils
-import numpy as np
 
 SHUFFLE_BUFFER_SIZE = 1000
+MAX_IN_MEMORY_SHUFFLE_BUFFER_SIZE = 50000
 
 # A common choice for the gradient penalty weighting
 # is 10.0
 GRADIENT_PENALTY_LAMBDA = 10.0
 
-def _compute_losses(discriminator, d_real, d_fake, interpolated):
+def _compute_discriminator_loss(d_real, d_fake, interpolation_gradient):
     """Base implementation of the function that computes the WGAN
-    generator and disciminator losses.
+    disciminator loss.
 
     Args:
-        discriminator: The discriminator function.
         d_real: The discriminator score for the real data points.
         d_fake: The discriminator score for the fake data points.
-        interpolated: The interpolation between the real and fake
-            data points.
+        interpolation_gradient: The gradient of the discriminator
+            score with respect to the interpolation between the
+            real and fake data points.
 
     Returns:
-        g_loss: The loss for the generator function.
-        d_loss: The loss for the discriminator function.
+        The loss for the discriminator function.
     """
     wasserstein_distance = tf.reduce_mean(d_real) - tf.reduce_mean(d_fake)
 
-    gradient_penalty = compute_gradient_penalty(discriminator, interpolated)
+    gradient_penalty = compute_slope_penalty(interpolation_gradient)
 
-    g_loss = tf.reduce_mean(d_fake)
-    d_loss = wasserstein_distance + GRADIENT_PENALTY_LAMBDA * gradient_penalty
+    return wasserstein_distance + GRADIENT_PENALTY_LAMBDA * gradient_penalty
 
-    return g_loss, d_loss
+def _compute_generator_loss(d_fake):
+    """Base implementation of the function that computes the WGAN
+    generator loss.
 
-def compute_gradient_penalty(discriminator, interpolated):
-    """Computes the gradient penalty for a discriminator.
+    Args:
+        d_fake: The discriminator score for the fake data points.
+
+    Returns:
+        The loss for the generator function.
+    """
+
+    return tf.reduce_mean(d_fake)
+
+def compute_slope_penalty(gradient):
+    """Computes the gradient penalty from the gradient of the
+    discriminator with respect to the interpolated data.
     According to [https://arxiv.org/abs/1704.00028]
 
     Args:
-        discriminator: The discriminator to compute the gradient
-            penalty for.
-        interpolated: The interpolation between real and fake data.
+        gradient: The gradient of the discriminator scores with
+            respect to the interpolation between real and fake data.
 
     Returns:
         The two norm of the difference between the discriminator gradients
         and one.
     """
 
-    with tf.GradientTape() as tape:
-        tape.watch(interpolated)
-        d_interpolated = discriminator(interpolated)
-
-    gradient = tape.gradient(d_interpolated, [interpolated])[0]
-    sum_axes = list(range(1, len(interpolated.shape)))
-    slopes = tf.sqrt(tf.reduce_sum(tf.square(gradient), axis=sum_axes))
+    # The penalty is always computed in float32, even when
+    # training with a mixed precision policy.
+    gradient = tf.cast(gradient, tf.float32)
+    # Flattening each gradient makes the norm a single row-wise reduction.
+    gradient = tf.reshape(gradient, [tf.shape(gradient)[0], -1])
+    slopes = tf.norm(gradient, axis=1)
     gradient_penalty = tf.reduce_mean((slopes - 1.0) ** 2.0)
 
     return gradient_penalty
 
+def get_scaled_loss(optimizer, loss):
+    """Scales a loss to avoid float16 gradient underflow, if the optimizer
+    is a LossScaleOptimizer. Must be called inside the gradient tape.
+
+    Args:
+        optimizer: The optimizer that will apply the gradients.
+        loss: The loss to be scaled.
+
+    Returns:
+        The scaled loss, or the given loss if the optimizer does
+        not use loss scaling.
+    """
+
+    if isinstance(optimizer, tf.keras.mixed_precision.LossScaleOptimizer):
+        return optimizer.get_scaled_loss(loss)
+    return loss
+
+def get_unscaled_gradients(optimizer, gradients):
+    """Reverses the loss scaling applied by get_scaled_loss.
+
+    Args:
+        optimizer: The optimizer that will apply the gradients.
+        gradients: The gradients of the scaled loss.
+
+    Returns:
+        The unscaled gradients.
+    """
+
+    if isinstance(optimizer, tf.keras.mixed_precision.LossScaleOptimizer):
+        return optimizer.get_unscaled_gradients(gradients)
+    return gradients
+
+def get_replica_seed(seed):
+    """Derives a distinct seed for each replica from a seed
+    shared by all replicas, so that the replicas do not draw
+    the same random numbers.
+
+    Args:
+        seed: A seed for stateless random ops, shape [2].
+
+    Returns:
+        The seed for the current replica, shape [2].
+    """
+
+    replica_id = tf.distribute.get_replica_context().replica_id_in_sync_group
+    return tf.random.experimental.stateless_fold_in(seed, replica_id)
+
 def get_representations(x_in):
     """The default function to get discriminator representations.
     Just an identity function that returns the singleton array
@@ -93,7 +150,19 @@ def get_representations(x_in):
 
     return [x_in]
 
-def get_interpolation(x_real, x_fake):
+def wait_for_save(save):
+    """Waits for a background save, as returned by fn_save_examples,
+    to complete. Any exception raised while saving is re-raised.
+
+    Args:
+        save: The value returned by fn_save_examples. Only
+            concurrent.futures.Future objects are waited on.
+    """
+
+    if isinstance(save, Future):
+        save.result()
+
+def get_interpolation(x_real, x_fake, seed=None):
     """Compute a linear interpolation of the real and generated
     data, this is used to compute the gradient penalty
     [https://arxiv.org/abs/1704.00028].
@@ -101,15 +170,24 @@ def get_interpolation(x_real, x_fake):
     Args:
         x_real: A batch of real data
         x_fake: A batch of generated data
+        seed: An optional seed (shape [2]) for the random interpolation
+            weights. If given, a stateless random op is used.
 
     Returns:
         A (random) linear interpolation between x_real
         and x_fake.
     """
 
-    alpha_shape = np.ones(len(x_real.shape))
-    alpha_shape[0] = x_real.shape[0]
-    alpha = tf.random.uniform(alpha_shape.astype(np.int32), 0.0, 1.0)
+    # One interpolation weight per data point, broadcast over the
+    # remaining dimensions. The batch size is read at run time so
+    # a change in batch size does not cause a retrace.
+    alpha_shape = tf.concat(
+        [tf.shape(x_real)[:1], tf.ones(len(x_real.shape) - 1, dtype=tf.int32)], axis=0
+    )
+    if seed is None:
+        alpha = tf.random.uniform(alpha_shape, 0.0, 1.0, dtype=x_real.dtype)
+    else:
+        alpha = tf.random.stateless_uniform(alpha_shape, seed, 0.0, 1.0, dtype=x_real.dtype)
     diff = x_fake - x_real
     interpolation = x_real + (alpha * diff)
 
@@ -130,13 +208,17 @@ class WGAN: # pylint: disable=too-many-instance-attributes
     def __init__(self, raw_dataset, generator, # pylint: disable=too-many-arguments, too-many-locals
                  discriminator, z_dim, generator_optimizer, discriminator_optimizer,
                  discriminator_training_ratio=5, batch_size=64, epochs=1,
-                 checkpoint_dir=None, epochs_per_save=10, fn_compute_loss=_compute_losses,
+                 checkpoint_dir=None, epochs_per_save=10,
+                 fn_compute_loss=_compute_discriminator_loss,
                  fn_get_discriminator_input_representations=get_representations,
-                 fn_save_examples=None):
+                 fn_save_examples=None, strategy=None,
+                 fn_compute_generator_loss=_compute_generator_loss,
+                 example_dataset=None):
         """Initilizes the WGAN class.
 
         Args:
-            raw_dataset: A numpy array containing the training dataset.
+            raw_dataset: A numpy array or an (un-batched) tf.data.Dataset
+                containing the training dataset.
             generator: The generator model.
             discriminator: A list of discriminator models. If only one 
                 discriminator then a singleton list should be given.
@@ -150,18 +232,31 @@ class WGAN: # pylint: disable=too-many-instance-attributes
             checkpoint_dir: Directory in which the model weights are saved. If
                     None, then the model is not saved.
             epochs_per_save: How often the model weights are saved.
-            fn_compute_loss: The function that computes the generator and
-                    discriminator loss. Must have signature
-                    f(model, d_real, d_fake, interpolated).
+            fn_compute_loss: The function that computes the discriminator
+                    loss. Must have signature
+                    f(d_real, d_fake, interpolation_gradient).
             fn_get_discriminator_input_representations: A function that takes
                 a data point (real and fake) and produces a list of representations,
                 one for each discriminator. Default is an identity function.
                 Signature expected is f(x_in), result should be an N element list
                 of representations.
             fn_save_examples: A function to save generations and real data,
-                    called after every epoch.
+                    called after every epoch. If it returns a
+                    concurrent.futures.Future, the save is waited on
+                    before the next one, and at the end of training.
+            strategy: The tf.distribute strategy used for training. The models
+                    and optimizers must be created under strategy.scope(). If
+                    None, the default (single device) strategy is used.
+            fn_compute_generator_loss: The function that computes the generator
+                    loss. Must have signature f(d_fake).
+            example_dataset: The data the real examples given to fn_save_examples
+                    are taken from, in the same form as raw_dataset. If None,
+                    raw_dataset is used. Useful when raw_dataset is cached, as
+                    reading a few examples from it before the first epoch
+                    would leave its cache partially written.
         """
         self.raw_dataset = raw_dataset
+        self.example_dataset = raw_dataset if example_dataset is None else example_dataset
         self.generator = generator
         self.discriminator = discriminator
         self.z_dim = z_dim
@@ -174,13 +269,49 @@ class WGAN: # pylint: disable=too-many-instance-attributes
         self.completed_epochs = 0
         self.epochs_per_save = epochs_per_save
         self.fn_compute_loss = fn_compute_loss
+        self.fn_compute_generator_loss = fn_compute_generator_loss
         self.fn_get_discriminator_input_representations = fn_get_discriminator_input_representations
         self.fn_save_examples = fn_save_examples
-
-        self.dataset = tf.data.Dataset.from_tensor_slices(self.raw_dataset).shuffle(
-            self.buffer_size).repeat(self.discriminator_training_ratio).batch(
-            self.batch_size, drop_remainder=False)
-
+        self.strategy = strategy if strategy else tf.distribute.get_strategy()
+
+        if tf.keras.mixed_precision.global_policy().compute_dtype == 'float16':
+            # Use dynamic loss scaling to avoid float16 gradient underflow.
+            with self.strategy.scope():
+                self.generator_optimizer = tf.keras.mixed_precision.LossScaleOptimizer(
+                    self.generator_optimizer
+                )
+                self.discriminator_optimizer = tf.keras.mixed_precision.LossScaleOptimizer(
+                    self.discriminator_optimizer
+                )
+
+        if isinstance(self.raw_dataset, tf.data.Dataset):
+            dataset = self.raw_dataset
+            self.dataset_length = tf.data.experimental.cardinality(dataset).numpy()
+            if self.dataset_length < 0:
+                # Infinite or unknown cardinality, the progress bar
+                # will not have a target.
+                self.dataset_length = None
+        else:
+            dataset = tf.data.Dataset.from_tensor_slices(self.raw_dataset)
+            self.dataset_length = len(self.raw_dataset)
+            # The data is already in memory, so the shuffle buffer
+            # can cover most (or all) of an epoch.
+            self.buffer_size = min(self.dataset_length, MAX_IN_MEMORY_SHUFFLE_BUFFER_SIZE)
+
+        # Counts the training steps, and seeds the stateless random
+        # ops used in each step.
+        with self.strategy.scope():
+            self.seed_counter = tf.Variable(0, dtype=tf.int64, trainable=False)
+
+        # The shape of a single data point, generations are given
+        # the same shape.
+        self.data_shape = dataset.element_spec.shape
+
+        # Remainder batches are dropped so that, when training with a
+        # distribution strategy, no replica receives an empty batch.
+        self.dataset = dataset.shuffle(
+            self.buffer_size, reshuffle_each_iteration=True).batch(
+            self.batch_size, drop_remainder=True).prefetch(tf.data.AUTOTUNE)
 
         if checkpoint_dir:
             self.checkpoint_dir = checkpoint_dir
@@ -189,7 +320,8 @@ class WGAN: # pylint: disable=too-many-instance-attributes
                 generator_optimizer=self.generator_optimizer,
                 discriminator_optimizer=self.discriminator_optimizer,
                 generator=self.generator,
-                discriminator=self.discriminator
+                discriminator=self.discriminator,
+                seed_counter=self.seed_counter
             )
 
 
@@ -208,55 +340,199 @@ class WGAN: # pylint: disable=too-many-instance-attributes
         print('Checkpoint ', checkpoint_path,
               ' restored at ', str(self.completed_epochs), ' epochs')
 
-    def _train_step(self, x_in, train_generator=True, train_discriminator=True): # pylint: disable=too-many-locals
+    def _train_step(self, x_in, seed, train_generator=True, train_discriminator=True):
         """Executes one training step of the WGAN model.
 
         Args:
             x_in: One batch of training data.
+            seed: The seed (shape [2]) for the random ops in this step,
+                shared by all replicas.
             train_generator: If true, the generator weights will be updated.
             train_discriminator: If true, the discriminator weights will be updated.
         """
 
+        seed = get_replica_seed(seed)
+        discriminator_seed, generator_seed = tf.unstack(
+            tf.random.experimental.stateless_split(seed, num=2)
+        )
+
+        if train_discriminator:
+            self._train_discriminator(x_in, discriminator_seed)
+
+        if train_generator:
+            self._train_generator(x_in, generator_seed)
+
+    def _train_discriminator(self, x_in, seed): # pylint: disable=too-many-locals
+        """Executes one update of the discriminator weights.
+
+        Args:
+            x_in: One batch of training data.
+            seed: The seed (shape [2]) for the random ops in this update.
+        """
+
+        seeds = tf.unstack(
+            tf.random.experimental.stateless_split(seed, num=len(self.discriminator) + 1)
+        )
+
         x_in_representations = self.fn_get_discriminator_input_representations(x_in)
-        z_in = tf.random.uniform((x_in.shape[0], self.z_dim), -1, 1)
-        
+        z_in = tf.random.stateless_uniform(
+            (tf.shape(x_in)[0], self.z_dim), seeds[0], -1, 1
+        )
+
+        # The generator is not updated, so no gradient is
+        # taken through it.
+        x_gen = tf.stop_gradient(self._generate(z_in, training=True))
+        x_gen_representations = self.fn_get_discriminator_input_representations(x_gen)
+
+        with tf.GradientTape() as disc_tape:
+            interpolations = [
+                get_interpolation(x_real, x_fake, interpolation_seed)
+                for x_real, x_fake, interpolation_seed in zip(
+                    x_in_representations, x_gen_representations, seeds[1:]
+                )
+            ]
+
+            # Score the real, fake and interpolated data in a
+            # single forward pass of each discriminator.
+            with tf.GradientTape() as interpolation_tape:
+                interpolation_tape.watch(interpolations)
+                d_scores = []
+                for discriminator, x_real, x_fake, interpolation in zip(
+                        self.discriminator, x_in_representations,
+                        x_gen_representations, interpolations):
+                    d_all = discriminator(
+                        tf.concat([x_real, x_fake, interpolation], axis=0), training=True
+                    )
+                    d_scores.append(tf.split(d_all, 3, axis=0))
+
+                # Each interpolation only feeds its own discriminator, so
+                # the gradient of the summed scores gives every
+                # discriminator's gradient in one backward pass.
+                d_interpolated_sum = tf.add_n([
+                    tf.reduce_sum(d_interpolated) for _, _, d_interpolated in d_scores
+                ])
+
+            interpolation_gradients = interpolation_tape.gradient(
+                d_interpolated_sum, interpolations
+            )
+
+            d_losses = [
+                self.fn_compute_loss(d_real, d_fake, interpolation_gradient)
+                for (d_real, d_fake, _), interpolation_gradient in zip(
+                    d_scores, interpolation_gradients
+                )
+            ]
+
+            # The discriminators share no weights, so the gradient of
+            # the summed losses is each discriminator's own gradient.
+            # Gradients are summed across replicas, so the losses are
+            # scaled to give the mean over the global batch.
+            d_loss = tf.add_n(d_losses) / self.strategy.num_replicas_in_sync
+            d_loss = get_scaled_loss(self.discriminator_optimizer, d_loss)
+
+        discriminator_variables = [
+            variable for discriminator in self.discriminator
+            for variable in discriminator.trainable_variables
+        ]
+        gradients_of_discriminator = disc_tape.gradient(d_loss, discriminator_variables)
+        gradients_of_discriminator = get_unscaled_gradients(
+            self.discriminator_optimizer, gradients_of_discriminator
+        )
+        self.discriminator_optimizer.apply_gradients(
+            zip(gradients_of_discriminator, discriminator_variables)
+        )
+
+    def _train_generator(self, x_in, seed):
+        """Executes one update of the generator weights.
+
+        Args:
+            x_in: One batch of training data, only used for
+                its batch size.
+            seed: The seed (shape [2]) for the random ops in this update.
+        """
+
+        z_in = tf.random.stateless_uniform((tf.shape(x_in)[0], self.z_dim), seed, -1, 1)
+
         with tf.GradientTape() as gen_tape:
-            g_loss = 0
-            
-            x_gen = tf.squeeze(self.generator(z_in, training=True))
+            x_gen = self._generate(z_in, training=True)
             x_gen_representations = self.fn_get_discriminator_input_representations(x_gen)
-            
-            for i in range(len(self.discriminator)):
-                with tf.GradientTape() as disc_tape:
-                    d_real = self.discriminator[i](x_in_representations[i], training=True)
-                    d_fake = self.discriminator[i](x_gen_representations[i], training=True)
 
-                    interpolation = get_interpolation(
-                        x_in_representations[i], x_gen_representations[i]
-                    )
+            g_losses = [
+                self.fn_compute_generator_loss(discriminator(x_fake, training=True))
+                for discriminator, x_fake in zip(self.discriminator, x_gen_representations)
+            ]
 
-                    g_loss_i, d_loss_i = self.fn_compute_loss(
-                        self.discriminator[i], d_real, d_fake, interpolation
-                    )
+            weightings = [discriminator.weighting for discriminator in self.discriminator]
+            g_loss = tf.reduce_sum(tf.stack(weightings) * tf.stack(g_losses))
+            g_loss /= self.strategy.num_replicas_in_sync
+            g_loss = get_scaled_loss(self.generator_optimizer, g_loss)
 
-                g_loss += self.discriminator[i].weighting * g_loss_i
-                
-                if train_discriminator:
-                    gradients_of_discriminator = disc_tape.gradient(
-                        d_loss_i, self.discriminator[i].trainable_variables
-                    )
-                    self.discriminator_optimizer.apply_gradients(
-                        zip(gradients_of_discriminator, self.discriminator[i].trainable_variables)
-                    )
-            
-        if train_generator:
-            gradients_of_generator = gen_tape.gradient(
-                g_loss, self.generator.trainable_variables
-            )
-            self.generator_optimizer.apply_gradients(
-                zip(gradients_of_generator, self.generator.trainable_variables)
-            )
+        gradients_of_generator = gen_tape.gradient(g_loss, self.generator.trainable_variables)
+        gradients_of_generator = get_unscaled_gradients(
+            self.generator_optimizer, gradients_of_generator
+        )
+        self.generator_optimizer.apply_gradients(
+            zip(gradients_of_generator, self.generator.trainable_variables)
+        )
+
+    def _generate(self, z_in, training):
+        """Generates a batch of data with the same shape
+        as the training data.
 
+        Args:
+            z_in: A batch of latent vectors.
+            training: If true, the generator is run in training mode.
+
+        Returns:
+            A batch of generated data.
+        """
+
+        x_gen = self.generator(z_in, training=training)
+        if self.data_shape.is_fully_defined():
+            # Unlike tf.squeeze, reshaping to the data shape keeps the
+            # static shape known, even when the batch size is not.
+            return tf.reshape(x_gen, [-1] + self.data_shape.as_list())
+
+        return tf.squeeze(x_gen)
+
+    def _get_step_seed(self):
+        """Increments the step counter and returns the seed for
+        the random ops in the next training step.
+
+        Returns:
+            A seed for stateless random ops, shape [2].
+        """
+
+        step = tf.convert_to_tensor(self.seed_counter.assign_add(1))
+        return tf.stack([step, tf.zeros_like(step)])
+
+    @tf.function
+    def _train_discriminator_step(self, x_in):
+        """Executes one graph compiled training step that only
+        updates the discriminator weights.
+
+        Args:
+            x_in: One (distributed) batch of training data.
+        """
+
+        seed = self._get_step_seed()
+        self.strategy.run(self._train_step, args=(x_in, seed), kwargs={
+            'train_generator': False, 'train_discriminator': True
+        })
+
+    @tf.function
+    def _train_generator_step(self, x_in):
+        """Executes one graph compiled training step that only
+        updates the generator weights.
+
+        Args:
+            x_in: One (distributed) batch of training data.
+        """
+
+        seed = self._get_step_seed()
+        self.strategy.run(self._train_step, args=(x_in, seed), kwargs={
+            'train_generator': True, 'train_discriminator': False
+        })
 
     def _generate_and_save_examples(self, epoch):
         """Generates a batch of fake samples and saves them, along with
@@ -265,15 +541,31 @@ class WGAN: # pylint: disable=too-many-instance-attributes
         Args:
             epoch: The current epoch, added as a post-fix of the file
                 name.
+
+        Returns:
+            The value returned by fn_save_examples, or None if
+            no examples are saved.
         """
 
         if self.fn_save_examples:
-            x_save = self.raw_dataset[np.random.randint(
-                low=0, high=len(self.raw_dataset), size=self.batch_size
-            )]
+            if isinstance(self.example_dataset, tf.data.Dataset):
+                # Take the first examples directly, iterating the
+                # training pipeline would fill its shuffle buffer.
+                x_save = next(iter(self.example_dataset.take(self.batch_size).batch(
+                    self.batch_size))).numpy()
+            else:
+                x_save = self.example_dataset[np.random.randint(
+                    low=0, high=len(self.example_dataset), size=self.batch_size
+                )]
             z_in = tf.random.uniform((len(x_save), self.z_dim), -1, 1)
-            generations = tf.squeeze(self.generator(z_in, training=False))
-            self.fn_save_examples(epoch, x_save, generations)
+
+            # The generator may be built by this call, so its weights
+            # must be created under the distribution strategy.
+            with self.strategy.scope():
+                generations = self._generate(z_in, training=False)
+            return self.fn_save_examples(epoch, x_save, generations)
+
+        return None
 
     def _get_training_dataset(self):
         """Function gives the dataset to use during training.
@@ -288,18 +580,21 @@ class WGAN: # pylint: disable=too-many-instance-attributes
     def train(self):
         """Executes the training for the WGAN model."""
 
-        self._generate_and_save_examples(0)
+        save = self._generate_and_save_examples(0)
         for epoch in range(self.completed_epochs, self.epochs):
-            pb_i = keras_utils.Progbar(len(self.raw_dataset))
+            pb_i = keras_utils.Progbar(self.dataset_length)
             start = time.time()
 
-            for i, x_batch in enumerate(self._get_training_dataset()):
-                self._train_step(x_batch, train_generator=False,
-                                 train_discriminator=True)
+            dataset = self.strategy.experimental_distribute_dataset(
+                self._get_training_dataset()
+            )
+            # Every discriminator update uses a distinct batch, so
+            # an epoch is a single pass over the dataset.
+            for i, x_batch in enumerate(dataset):
+                self._train_discriminator_step(x_batch)
                 if (i + 1) % self.discriminator_training_ratio == 0:
-                    self._train_step(x_batch, train_generator=True,
-                                     train_discriminator=False)
-                    pb_i.add(self.batch_size)
+                    self._train_generator_step(x_batch)
+                pb_i.add(self.batch_size)
 
 
             if self.checkpoint_prefix and (epoch + 1) % self.epochs_per_save == 0:
@@ -307,4 +602,7 @@ class WGAN: # pylint: disable=too-many-instance-attributes
 
             print('\nTime for epoch {} is {} minutes'.format(epoch + 1,
                                                              (time.time() - start) / 60))
-            self._generate_and_save_examples(epoch + 1)
+            wait_for_save(save)
+            save = self._generate_and_save_examples(epoch + 1)
+
+        wait_for_save(save)
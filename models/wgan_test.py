@@ -28,6 +28,13 @@ class SpectralTest(tf.test.TestCase):
         interpolation = wgan.get_interpolation(x1, x2)
         self.assertShapeEqual(x1, interpolation)
 
+    def test_slope_penalty_unit_norm(self):
+        gradient = np.random.normal(size=(10, 256, 32)).astype(np.float32)
+        gradient /= np.sqrt(np.sum(gradient ** 2, axis=(1, 2), keepdims=True))
+
+        penalty = wgan.compute_slope_penalty(gradient)
+        self.assertAllClose(0.0, penalty, atol=1e-5)
+
 if __name__ == '__main__':
     os.environ["CUDA_VISIBLE_DEVICES"] = ''
     tf.test.main()
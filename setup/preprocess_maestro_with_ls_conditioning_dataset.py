@@ -22,7 +22,8 @@ The music chunks are then saved as a .npz file
 import os
 import sys
 import glob
-import librosa
+import itertools
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 from audio_synthesis.setup import preprocessing_helpers
 
@@ -36,33 +37,54 @@ PROCESSED_DATA_PATH = './data/'
 
 def main():
     audio_paths = glob.glob(RAW_DATA_PATH + '/**/*.wav', recursive=True)
+    audio_paths = preprocessing_helpers.select_files_by_duration(
+        audio_paths, APPROX_TOTAL_HOURS
+    )
 
-    # Load audio files until we reach our desired
-    # data set size.
-    data = []
-    data_conditioning = []
-    hours_loaded = 0
-    for audio_file_path in audio_paths:
-        print(audio_file_path)
-        wav, _ = librosa.load(audio_file_path, sr=SAMPLE_RATE)
-
-        hours_loaded += len(wav) / SAMPLE_RATE / 60 / 60
-        if hours_loaded >= APPROX_TOTAL_HOURS:
-            break
-
-        waveform_chunks, _ = preprocessing_helpers.waveform_2_chunks(
-            wav, DATA_POINT_LENGTH
+    # The chunks are written into a single pre-allocated buffer, sized
+    # from APPROX_TOTAL_HOURS plus one padded chunk per file. The file
+    # durations are only approximate after resampling, so the buffer
+    # is grown below if a file would overflow it.
+    max_chunks = int(APPROX_TOTAL_HOURS * 60 * 60 * SAMPLE_RATE / DATA_POINT_LENGTH)
+    max_chunks += len(audio_paths)
+    chunks = np.zeros((max_chunks, DATA_POINT_LENGTH), dtype=np.float32)
+    is_first_chunk = np.zeros(max_chunks, dtype=bool)
+
+    # Load the selected audio files in parallel. The results are
+    # consumed in path order, so the chunk order is reproducible,
+    # and each waveform is released once it has been copied.
+    n_chunks = 0
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+        wavs = executor.map(
+            preprocessing_helpers.load_waveform, audio_paths, itertools.repeat(SAMPLE_RATE)
         )
 
-        conditioning_chunks = waveform_chunks[0:-1]
-        conditioning_chunks = conditioning_chunks[:, CONDITIONING_START_INDEX:]
-        waveform_chunks = waveform_chunks[1:]
+        for path, wav in zip(audio_paths, wavs):
+            print(path)
+
+            n_wav_chunks = -(-len(wav) // DATA_POINT_LENGTH)
+            if n_wav_chunks == 0:
+                continue
 
-        data.extend(waveform_chunks)
-        data_conditioning.extend(conditioning_chunks)
+            if n_chunks + n_wav_chunks > len(chunks):
+                n_extra = max(n_chunks + n_wav_chunks, 2 * len(chunks)) - len(chunks)
+                chunks = np.concatenate(
+                    [chunks, np.zeros((n_extra, DATA_POINT_LENGTH), dtype=np.float32)]
+                )
+                is_first_chunk = np.concatenate(
+                    [is_first_chunk, np.zeros(n_extra, dtype=bool)]
+                )
 
-    data = np.array(data)
-    data_conditioning = np.array(data_conditioning)
+            is_first_chunk[n_chunks] = True
+            n_chunks += preprocessing_helpers.write_waveform_chunks(
+                wav, DATA_POINT_LENGTH, chunks[n_chunks:]
+            )
+
+    # Each chunk is conditioned on the second half of the previous
+    # chunk from the same file.
+    data_idx = np.flatnonzero(~is_first_chunk[:n_chunks])
+    data = chunks[data_idx]
+    data_conditioning = chunks[data_idx - 1, CONDITIONING_START_INDEX:]
 
     print('Dataset Stats:')
     print('Total Hours: ', len(data) / 60 / 60)
@@ -70,12 +92,19 @@ def main():
     print('Dataset Shape: ', data.shape)
 
     print("Saving Waveform Dataset")
+    preprocessing_helpers.write_tfrecord_shards(
+        data, os.path.join(PROCESSED_DATA_PATH, 'MAESTRO_ls_{}h'.format(APPROX_TOTAL_HOURS)),
+        conditioning=data_conditioning
+    )
+
+    # The result scripts still load the data and conditioning
+    # as .npz files.
     np.savez_compressed(os.path.join(PROCESSED_DATA_PATH, 'MAESTRO_ls_{}h.npz'\
                         .format(APPROX_TOTAL_HOURS)),
-                        np.array(data))
+                        data)
     np.savez_compressed(os.path.join(PROCESSED_DATA_PATH, 'MAESTRO_ls_hlf_cond_{}h.npz'\
                         .format(APPROX_TOTAL_HOURS)),
-                        np.array(data_conditioning))
+                        data_conditioning)
 
 if __name__ == '__main__':
     main()
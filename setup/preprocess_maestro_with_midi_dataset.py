@@ -24,7 +24,6 @@ the MIDI data.
 import sys
 import os
 import glob
-import librosa
 import mido
 import numpy as np
 from audio_synthesis.setup import preprocessing_helpers
@@ -43,19 +42,16 @@ PROCESSED_DATA_PATH = './data/'
 
 def main():
     audio_paths = glob.glob(RAW_DATA_PATH + '/**/*.wav', recursive=True)
+    audio_paths = preprocessing_helpers.select_files_by_duration(
+        audio_paths, APPROX_TOTAL_HOURS
+    )
 
-    # Load audio files until we reach our desired
-    # data set size.
+    # Load the selected audio files.
     data = []
     midi_data = []
-    hours_loaded = 0
     for audio_file_path in audio_paths:
         print(audio_file_path)
-        wav, _ = librosa.load(audio_file_path, sr=SAMPLE_RATE)
-
-        hours_loaded += len(wav) / SAMPLE_RATE / 60 / 60
-        if hours_loaded >= APPROX_TOTAL_HOURS:
-            break
+        wav = preprocessing_helpers.load_waveform(audio_file_path, SAMPLE_RATE)
 
         waveform_chunks, padded_wav_length = preprocessing_helpers.waveform_2_chunks(
             wav, DATA_POINT_LENGTH
@@ -25,7 +25,6 @@ import sys
 import os
 import glob
 import tqdm
-import librosa
 import numpy as np
 from audio_synthesis.setup import preprocessing_helpers
 
@@ -38,7 +37,12 @@ SUB_FOLDERS = ['zero', 'one', 'two', 'three', 'four', 'five',
 LIMIT_PER_FOLDER = 1850
 
 def main():
-    waveforms = []
+    # The clips are at most one second long, so each is written into a
+    # single zero padded row of a pre-allocated buffer.
+    waveforms = np.zeros(
+        (len(SUB_FOLDERS) * LIMIT_PER_FOLDER, PADDED_DATA_POINT_LENGTH), dtype=np.float32
+    )
+    n_waveforms = 0
     for folder in SUB_FOLDERS:
         folder_path = os.path.join(RAW_DATA_PATH, folder)
         loaded_paths = glob.glob(os.path.join(folder_path, '*.wav'))
@@ -46,15 +50,20 @@ def main():
         loaded_paths = loaded_paths[:LIMIT_PER_FOLDER]
 
         for audio_file_path in tqdm.tqdm(loaded_paths):
-            wav, _ = librosa.load(audio_file_path, sr=SAMPLE_RATE)
+            wav = preprocessing_helpers.load_waveform(audio_file_path, SAMPLE_RATE)
+            if len(wav) > PADDED_DATA_POINT_LENGTH:
+                raise ValueError(
+                    '{} has {} samples, more than the {} that fit in one data point.'\
+                    .format(audio_file_path, len(wav), PADDED_DATA_POINT_LENGTH)
+                )
 
-            wav, _ = preprocessing_helpers.waveform_2_chunks(
-                wav, PADDED_DATA_POINT_LENGTH
+            n_waveforms += preprocessing_helpers.write_waveform_chunks(
+                wav, PADDED_DATA_POINT_LENGTH, waveforms[n_waveforms:]
             )
 
-            waveforms.extend(wav)
-
-    waveforms = np.array(waveforms)
+    # Folders with fewer than LIMIT_PER_FOLDER clips leave rows unfilled,
+    # which must not be saved as silent examples.
+    waveforms = waveforms[:n_waveforms]
 
     print('Dataset Stats:')
     print('Total Hours: ', len(waveforms) / 60 / 60)
@@ -64,7 +73,7 @@ def main():
     print("Saving Waveform Dataset")
     np.savez_compressed(os.path.join(PROCESSED_DATA_PATH, 'SpeechMNIST_{}.npz'\
                         .format(LIMIT_PER_FOLDER)),
-                        np.array(waveforms))
+                        waveforms)
 
 if __name__ == '__main__':
     main()
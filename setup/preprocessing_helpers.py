@@ -16,15 +16,70 @@
 and preprocessing waveform and MIDI data.
 """
 
-import copy
 import mido
 import numpy as np
+import soundfile as sf
+import tensorflow as tf
+from scipy.signal import resample_poly
 
 KEY_OFFSET = 21 # Piano notes start from midi node index 21.
 MAX_KEY_VELOCITY = 127
 N_PIANO_KEYS = 88
 N_STATE_SLOTS = N_PIANO_KEYS + 1 # An additional slot for the sustain pedal.
 TEMPO = 500000 # microseconds per beat
+TFRECORD_SHARD_BYTES = 256 * 1024 * 1024 # Approximate size of each TFRecord shard.
+
+def load_waveform(path, sample_rate):
+    """Loads an audio file as a mono waveform.
+
+    Decodes with libsndfile and resamples with a polyphase
+    filter, which is much faster than librosa's default
+    resampler. Defined at the module level so that it can
+    be used by worker processes.
+
+    Args:
+        path: The path to the audio file.
+        sample_rate: The sample rate (samples per second) the
+            audio is resampled to.
+
+    Returns:
+        The loaded waveform. Shape is [time].
+    """
+
+    waveform, file_sample_rate = sf.read(path, dtype='float32')
+    if waveform.ndim > 1:
+        waveform = np.mean(waveform, axis=1)
+
+    if file_sample_rate != sample_rate:
+        waveform = resample_poly(waveform, sample_rate, file_sample_rate)
+
+    return waveform.astype(np.float32)
+
+def select_files_by_duration(paths, max_hours):
+    """Selects audio files, in order, until their total duration
+    would reach a given number of hours.
+
+    Only the file headers are read, so files that do not fit
+    in the budget are never decoded.
+
+    Args:
+        paths: The paths to the audio files.
+        max_hours: The maximum total duration (in hours).
+
+    Returns:
+        The selected paths.
+    """
+
+    selected_paths = []
+    total_hours = 0
+    for path in paths:
+        total_hours += sf.info(path).duration / 60 / 60
+        if total_hours >= max_hours:
+            break
+
+        selected_paths.append(path)
+
+    return selected_paths
 
 def waveform_2_chunks(wavform, chunk_length):
     """Converts a given waveform into chunks of a pre-defined
@@ -52,6 +107,87 @@ def waveform_2_chunks(wavform, chunk_length):
     chunks = np.reshape(wavform, (-1, chunk_length))
     return chunks, padded_wav_length
 
+def write_waveform_chunks(waveform, chunk_length, buffer):
+    """Splits a given waveform into chunks of a pre-defined size and
+    writes them into a pre-allocated buffer. The final chunk is zero
+    padded, as in waveform_2_chunks, but no padded copy of the waveform
+    is made.
+
+    Args:
+        waveform: The waveform to be processed. Expected
+            shape is [time].
+        chunk_length: The desired length (in samples) of the
+            chunks the input waveform will be split into.
+        buffer: The array the chunks are written into. Expected
+            shape is [>= ceil(time / chunk_length), chunk_length].
+
+    Returns:
+        The number of chunks written into the buffer.
+    """
+
+    n_full_chunks = len(waveform) // chunk_length
+    full_length = n_full_chunks * chunk_length
+    buffer[:n_full_chunks] = np.reshape(waveform[:full_length], (n_full_chunks, chunk_length))
+
+    remainder = len(waveform) - full_length
+    if remainder == 0:
+        return n_full_chunks
+
+    buffer[n_full_chunks, :remainder] = waveform[full_length:]
+    buffer[n_full_chunks, remainder:] = 0
+    return n_full_chunks + 1
+
+def write_tfrecord_shards(chunks, path_prefix, conditioning=None,
+                          shard_bytes=TFRECORD_SHARD_BYTES):
+    """Writes waveform chunks to a set of TFRecord shards.
+
+    Each chunk is serialized as a tf.train.Example with
+    the float feature 'audio', and optionally the float
+    feature 'conditioning'.
+
+    Args:
+        chunks: The waveform chunks to be written. Shape is
+            [n_chunks, chunk_length].
+        path_prefix: The path prefix for the shards. Shards are
+            named <path_prefix>-<shard>-of-<n_shards>.tfrecord.
+        conditioning: The conditioning information for each chunk,
+            stored in the same example as the chunk. Shape is
+            [n_chunks, conditioning_length]. If None, no
+            conditioning is written.
+        shard_bytes: The approximate size (in bytes) of the raw
+            data stored in each shard.
+
+    Returns:
+        A list of paths to the written shards.
+    """
+
+    example_bytes = chunks[0].nbytes
+    if conditioning is not None:
+        example_bytes += conditioning[0].nbytes
+
+    chunks_per_shard = max(1, shard_bytes // example_bytes)
+    n_shards = -(-len(chunks) // chunks_per_shard)
+
+    shard_paths = []
+    for shard in range(n_shards):
+        shard_path = '{}-{:05d}-of-{:05d}.tfrecord'.format(path_prefix, shard, n_shards)
+        with tf.io.TFRecordWriter(shard_path) as writer:
+            for i in range(shard * chunks_per_shard,
+                           min((shard + 1) * chunks_per_shard, len(chunks))):
+                feature = {
+                    'audio': tf.train.Feature(float_list=tf.train.FloatList(value=chunks[i]))
+                }
+                if conditioning is not None:
+                    feature['conditioning'] = tf.train.Feature(
+                        float_list=tf.train.FloatList(value=conditioning[i])
+                    )
+
+                example = tf.train.Example(features=tf.train.Features(feature=feature))
+                writer.write(example.SerializeToString())
+        shard_paths.append(shard_path)
+
+    return shard_paths
+
 def midi_2_absolute_time(midi_track):
     """Converts a relative time MIDI track to
     absolute time. Modifies the MIDI track in
@@ -115,13 +251,15 @@ def piano_midi_2_chunks(midi, padded_wav_length, chunk_length, num_states_per_ch
         :round(total_time_in_ticks / float(ticks_per_state))
     ]
 
-    states = []
+    # The states are written directly into a pre-allocated array,
+    # indexed by key, rather than copied one at a time into a list.
+    states = np.zeros((len(end_tick_indicies), N_STATE_SLOTS))
     state = np.zeros((N_STATE_SLOTS))
     event_idx = 0
 
     # For each quantied zone in the chunk, update the state information,
     # with the events that occour in the zone and append the state to the record.
-    for end_tick_index in end_tick_indicies:
+    for state_idx, end_tick_index in enumerate(end_tick_indicies):
         while event_idx < len(track) and track[event_idx].time < end_tick_index:
             note_type = track[event_idx].type
 
@@ -140,7 +278,7 @@ def piano_midi_2_chunks(midi, padded_wav_length, chunk_length, num_states_per_ch
                 state[-1] = track[event_idx].value / MAX_KEY_VELOCITY
 
             event_idx += 1
-        states.append(copy.deepcopy(state))
+        states[state_idx] = state
     
     states = np.reshape(states, (-1, num_states_per_chunk, N_STATE_SLOTS))
     return states
@@ -3,6 +3,7 @@
 
 import os
 import mido
+import soundfile as sf
 import tensorflow as tf
 import numpy as np
 
@@ -38,6 +39,88 @@ class LayersTest(tf.test.TestCase):
             (expected_padded_signal_length // chunk_length, chunk_length)
         )
 
+    def test_write_waveform_chunks_matches_waveform_2_chunks(self):
+        signal_length = 120
+        chunk_length = 16
+        waveform = np.arange(1, signal_length + 1).astype(np.float32)
+        expected_chunks, _ = preprocessing_helpers.waveform_2_chunks(waveform, chunk_length)
+
+        buffer = np.ones((10, chunk_length), dtype=np.float32)
+        n_chunks = preprocessing_helpers.write_waveform_chunks(
+            waveform, chunk_length, buffer
+        )
+
+        self.assertEqual(n_chunks, len(expected_chunks))
+        self.assertAllEqual(buffer[:n_chunks], expected_chunks)
+
+    def test_load_waveform_resamples_to_mono(self):
+        file_sample_rate = 44100
+        sample_rate = 16000
+        stereo = np.random.uniform(-0.5, 0.5, (file_sample_rate, 2)).astype(np.float32)
+        path = os.path.join(self.get_temp_dir(), 'stereo.wav')
+        sf.write(path, stereo, file_sample_rate, subtype='FLOAT')
+
+        waveform = preprocessing_helpers.load_waveform(path, sample_rate)
+
+        self.assertEqual(waveform.shape, (sample_rate,))
+        self.assertEqual(waveform.dtype, np.float32)
+
+    def test_select_files_by_duration(self):
+        sample_rate = 16000
+        paths = []
+        for i in range(3):
+            path = os.path.join(self.get_temp_dir(), '{}.wav'.format(i))
+            sf.write(path, np.zeros(60 * sample_rate, dtype=np.float32), sample_rate)
+            paths.append(path)
+
+        selected_paths = preprocessing_helpers.select_files_by_duration(paths, 2.5 / 60)
+        self.assertEqual(selected_paths, paths[:2])
+
+    def test_write_tfrecord_shards(self):
+        chunk_length = 16
+        chunks = np.random.uniform(-1, 1, (10, chunk_length)).astype(np.float32)
+        path_prefix = os.path.join(self.get_temp_dir(), 'chunks')
+
+        shard_paths = preprocessing_helpers.write_tfrecord_shards(
+            chunks, path_prefix, shard_bytes=4 * chunks[0].nbytes
+        )
+
+        features = {'audio': tf.io.FixedLenFeature([chunk_length], tf.float32)}
+        records = tf.data.TFRecordDataset(shard_paths).map(
+            lambda x: tf.io.parse_single_example(x, features)['audio']
+        )
+
+        self.assertEqual(len(shard_paths), 3)
+        self.assertAllEqual(np.stack(list(records.as_numpy_iterator())), chunks)
+
+    def test_write_tfrecord_shards_with_conditioning(self):
+        chunk_length = 16
+        conditioning_length = 8
+        chunks = np.random.uniform(-1, 1, (10, chunk_length)).astype(np.float32)
+        conditioning = np.random.uniform(
+            -1, 1, (10, conditioning_length)
+        ).astype(np.float32)
+        path_prefix = os.path.join(self.get_temp_dir(), 'conditioned_chunks')
+
+        shard_paths = preprocessing_helpers.write_tfrecord_shards(
+            chunks, path_prefix, conditioning=conditioning,
+            shard_bytes=4 * (chunks[0].nbytes + conditioning[0].nbytes)
+        )
+
+        features = {
+            'audio': tf.io.FixedLenFeature([chunk_length], tf.float32),
+            'conditioning': tf.io.FixedLenFeature([conditioning_length], tf.float32),
+        }
+        records = list(tf.data.TFRecordDataset(shard_paths).map(
+            lambda x: tf.io.parse_single_example(x, features)
+        ).as_numpy_iterator())
+
+        self.assertEqual(len(shard_paths), 3)
+        self.assertAllEqual(np.stack([record['audio'] for record in records]), chunks)
+        self.assertAllEqual(
+            np.stack([record['conditioning'] for record in records]), conditioning
+        )
+
     def test_midi_2_absolute_time(self):
         n_messages = 10
         track = mido.MidiTrack()
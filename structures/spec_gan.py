@@ -31,7 +31,8 @@ from tensorflow import keras
 class Generator(keras.Model):
     """Implementation of the SpecGAN Generator Function."""
 
-    def __init__(self, channels=1, activation=activations.linear, in_shape=(4, 4, 1024)):
+    def __init__(self, channels=1, activation=activations.linear, in_shape=(4, 4, 1024),
+                 jit_compile=False):
         """Initilizes the SpecGAN Generator function.
 
         Args:
@@ -43,32 +44,42 @@ class Generator(keras.Model):
                 before being returned. Default is linear.
             in_shape: Transformed noise shape as input to the
                 generator function.
+            jit_compile: If true, the forward pass is compiled with XLA,
+                fusing each convolution with its activation. Compiling
+                is slow on CPU, so this is intended for GPU training.
         """
 
         super(Generator, self).__init__()
 
+        self.channels = channels
         self.activation = activation
+        self.in_shape = in_shape
 
-        sequential = []
-        sequential.append(layers.Dense(np.prod(in_shape)))
-        sequential.append(layers.Reshape((in_shape)))
-        sequential.append(layers.ReLU())
-        sequential.append(layers.Conv2DTranspose(filters=512, kernel_size=(6, 6),
-                                                 strides=(2, 2), padding='same'))
-        sequential.append(layers.ReLU())
-        sequential.append(layers.Conv2DTranspose(filters=256, kernel_size=(6, 6),
-                                                 strides=(2, 2), padding='same'))
-        sequential.append(layers.ReLU())
-        sequential.append(layers.Conv2DTranspose(filters=128, kernel_size=(6, 6),
-                                                 strides=(2, 2), padding='same'))
-        sequential.append(layers.ReLU())
-        sequential.append(layers.Conv2DTranspose(filters=64, kernel_size=(6, 6),
-                                                 strides=(2, 2), padding='same'))
-        sequential.append(layers.ReLU())
-        sequential.append(layers.Conv2DTranspose(filters=channels, kernel_size=(6, 6),
-                                                 strides=(2, 2), padding='same'))
-
-        self.l = keras.Sequential(sequential)
+        if jit_compile:
+            self.call = tf.function(self.call, jit_compile=True)
+
+    def build(self, input_shape):
+        """Builds the generator network as a functional model, once
+        the size of the noise vectors is known.
+
+        Args:
+            input_shape: The shape of the input noise vectors,
+                (batch_size, z_dim).
+        """
+
+        z_in = keras.Input(shape=input_shape[1:])
+        x_out = layers.Dense(np.prod(self.in_shape), activation='relu')(z_in)
+        x_out = layers.Reshape(self.in_shape)(x_out)
+        for filters in [512, 256, 128, 64]:
+            x_out = layers.Conv2DTranspose(filters=filters, kernel_size=(6, 6), strides=(2, 2),
+                                           padding='same', activation='relu')(x_out)
+        # The output layer is kept in float32 for numerical stability
+        # when training with a mixed precision policy.
+        x_out = layers.Conv2DTranspose(filters=self.channels, kernel_size=(6, 6),
+                                       strides=(2, 2), padding='same', dtype='float32')(x_out)
+
+        self.l = keras.Model(z_in, x_out)
+        super(Generator, self).build(input_shape)
 
     def call(self, z_in):
         """Generates spectograms from input noise vectors.
@@ -87,7 +98,7 @@ class Generator(keras.Model):
 class Discriminator(keras.Model):
     """Implementation of the SpecGAN Discriminator Function."""
 
-    def __init__(self, input_shape, weighting=1.0):
+    def __init__(self, input_shape, weighting=1.0, jit_compile=False):
         """Initilizes the SpecGAN Discriminator function
         
         Args:
@@ -95,33 +106,31 @@ class Discriminator(keras.Model):
                 discriminator functions.
             weighting: The relative weighting of this discriminator in
                 the overall loss.
+            jit_compile: If true, the forward pass is compiled with XLA,
+                fusing each convolution with its activation. Compiling
+                is slow on CPU, so this is intended for GPU training.
         """
         
         super(Discriminator, self).__init__()
 
         self.in_shape = input_shape
         self.weighting = weighting
-        
-        sequential = []
-        sequential.append(layers.Conv2D(filters=64, kernel_size=(6, 6),
-                                        strides=(2, 2), padding='same'))
-        sequential.append(layers.LeakyReLU(alpha=0.2))
-        sequential.append(layers.Conv2D(filters=128, kernel_size=(6, 6),
-                                        strides=(2, 2), padding='same'))
-        sequential.append(layers.LeakyReLU(alpha=0.2))
-        sequential.append(layers.Conv2D(filters=256, kernel_size=(6, 6),
-                                        strides=(2, 2), padding='same'))
-        sequential.append(layers.LeakyReLU(alpha=0.2))
-        sequential.append(layers.Conv2D(filters=512, kernel_size=(6, 6),
-                                        strides=(2, 2), padding='same'))
-        sequential.append(layers.LeakyReLU(alpha=0.2))
-        sequential.append(layers.Conv2D(filters=1024, kernel_size=(6, 6),
-                                        strides=(2, 2), padding='same'))
-        sequential.append(layers.LeakyReLU(alpha=0.2))
-        sequential.append(layers.Flatten())
-        sequential.append(layers.Dense(1))
-
-        self.l = keras.Sequential(sequential)
+
+        x_in = keras.Input(shape=input_shape[1:])
+        x_out = x_in
+        for filters in [64, 128, 256, 512, 1024]:
+            x_out = layers.Conv2D(filters=filters, kernel_size=(6, 6),
+                                  strides=(2, 2), padding='same')(x_out)
+            x_out = layers.LeakyReLU(alpha=0.2)(x_out)
+        x_out = layers.Flatten()(x_out)
+        # The critic score is kept in float32 for numerical stability
+        # when training with a mixed precision policy.
+        x_out = layers.Dense(1, dtype='float32')(x_out)
+
+        self.l = keras.Model(x_in, x_out)
+
+        if jit_compile:
+            self.call = tf.function(self.call, jit_compile=True)
 
     def call(self, x_in):
         """Produces discriminator scores for the inputs.
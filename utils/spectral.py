@@ -14,14 +14,94 @@
 
 """Provides functionality for converting audio representations."""
 
+import heapq
+import functools
+from concurrent.futures import ThreadPoolExecutor
 import tensorflow as tf
 import numpy as np
 from librosa.core import griffinlim
+from librosa.util import nnls
 
 _EPSILON = 1e-6
 _SAMPLE_RATE = 16000
 WINDOW_FN = tf.signal.hamming_window
 
+# Time-frequency ratio of the Gaussian approximating a Hamming window,
+# relative to frame_length**2, as tabulated in ltfat's pghi.
+_HAMMING_GAMMA = 0.29794
+
+
+@functools.lru_cache(maxsize=32)
+def _get_mel_matrix(n_mel_bins, n_stft_bins, mel_lower_hertz_edge,
+                    mel_upper_hertz_edge, dtype=tf.float32):
+    """Returns the linear to mel weight matrix, shape [n_stft_bins, n_mel_bins].
+
+    The matrix is created eagerly, even when first requested while tracing
+    a tf.function, so the cached constant can be shared by every graph.
+    """
+
+    with tf.init_scope():
+        return tf.cast(tf.signal.linear_to_mel_weight_matrix(
+            n_mel_bins, n_stft_bins, _SAMPLE_RATE, mel_lower_hertz_edge,
+            mel_upper_hertz_edge
+        ), dtype)
+
+@functools.lru_cache(maxsize=32)
+def _get_inv_mel_matrix(n_mel_bins, n_stft_bins, mel_lower_hertz_edge,
+                        mel_upper_hertz_edge):
+    """Returns the pseudo inverse of the linear to mel weight matrix,
+    shape [n_mel_bins, n_stft_bins].
+    """
+
+    with tf.init_scope():
+        return tf.linalg.pinv(_get_mel_matrix(
+            n_mel_bins, n_stft_bins, mel_lower_hertz_edge, mel_upper_hertz_edge
+        ))
+
+@functools.lru_cache(maxsize=16)
+def _get_window(frame_length, dtype=tf.float32):
+    """Returns the WINDOW_FN analysis window, shape [frame_length]."""
+
+    with tf.init_scope():
+        return WINDOW_FN(frame_length, dtype=dtype)
+
+@functools.lru_cache(maxsize=16)
+def _get_inv_window(frame_length, frame_step, dtype=tf.float32):
+    """Returns the synthesis window that inverts WINDOW_FN for the given
+    frame configuration, shape [frame_length].
+    """
+
+    with tf.init_scope():
+        inv_window_fn = tf.signal.inverse_stft_window_fn(
+            frame_step, forward_window_fn=WINDOW_FN
+        )
+        return inv_window_fn(frame_length, dtype=dtype)
+
+def _get_fft_length(frame_length):
+    """Returns the FFT length used by tf.signal.stft for a given frame
+    length, the smallest power of two that is at least frame_length.
+    """
+
+    return 2**int(np.ceil(np.log2(frame_length)))
+
+def _matmul_last_axis(tensor_in, matrix):
+    """Multiplies the last axis of a tensor with a matrix.
+
+    Same as tf.tensordot(tensor_in, matrix, 1), expressed as a single
+    matmul over the flattened leading axes.
+
+    Args:
+        tensor_in: The tensor to be projected, shape [..., n].
+        matrix: The projection matrix, shape [n, m].
+
+    Returns:
+        The projected tensor, shape [..., m].
+    """
+
+    flat_out = tf.matmul(tf.reshape(tensor_in, [-1, matrix.shape[0]]), matrix)
+    return tf.reshape(
+        flat_out, tf.concat([tf.shape(tensor_in)[:-1], [matrix.shape[1]]], 0)
+    )
 
 def _linear_to_mel_scale(linear_scale_in, n_mel_bins, mel_lower_hertz_edge,
                          mel_upper_hertz_edge):
@@ -29,7 +109,8 @@ def _linear_to_mel_scale(linear_scale_in, n_mel_bins, mel_lower_hertz_edge,
 
     Args:
         linear_scale_in: The linear scale spectogram. Expected shape is
-            [-1, time, frequency, 1].
+            [-1, time, frequency, 1]. The projection is computed in its
+            dtype.
         n_mel_bins: The number of mel bins.
         mel_lower_hertz_edge: The lowest frequency in hertz to include in the
             mel spectrum
@@ -42,12 +123,12 @@ def _linear_to_mel_scale(linear_scale_in, n_mel_bins, mel_lower_hertz_edge,
         n_mel_bins.
     """
 
-    linear_to_mel_weight_matrix = tf.signal.linear_to_mel_weight_matrix(
-        n_mel_bins, linear_scale_in.shape[-1], _SAMPLE_RATE, mel_lower_hertz_edge,
-        mel_upper_hertz_edge
+    linear_to_mel_weight_matrix = _get_mel_matrix(
+        n_mel_bins, linear_scale_in.shape[-1], mel_lower_hertz_edge,
+        mel_upper_hertz_edge, linear_scale_in.dtype
     )
 
-    mel_scale_out = tf.tensordot(linear_scale_in, linear_to_mel_weight_matrix, 1)
+    mel_scale_out = _matmul_last_axis(linear_scale_in, linear_to_mel_weight_matrix)
     return mel_scale_out
 
 def _mel_to_linear_scale(mel_scale_in, n_stft_bins, mel_lower_hertz_edge,
@@ -70,15 +151,362 @@ def _mel_to_linear_scale(mel_scale_in, n_stft_bins, mel_lower_hertz_edge,
         n_stft_bins.
     """
 
-    linear_to_mel_weight_matrix = tf.signal.linear_to_mel_weight_matrix(
-        mel_scale_in.shape[-1], n_stft_bins, _SAMPLE_RATE, mel_lower_hertz_edge,
+    mel_to_linear_weight_matrix = _get_inv_mel_matrix(
+        mel_scale_in.shape[-1], n_stft_bins, mel_lower_hertz_edge,
         mel_upper_hertz_edge
     )
-    mel_to_linear_weight_matrix = tf.linalg.pinv(linear_to_mel_weight_matrix)
 
-    linear_scale_out = tf.tensordot(mel_scale_in, mel_to_linear_weight_matrix, 1)
+    linear_scale_out = _matmul_last_axis(mel_scale_in, mel_to_linear_weight_matrix)
     return linear_scale_out
 
+def _mel_to_linear_magnitude(mel_magnitude_in, n_stft_bins, mel_lower_hertz_edge,
+                             mel_upper_hertz_edge):
+    """Converts a mel scale magnitude spectrum to a linear scale, using
+    non-negative least squares.
+
+    Unlike the pseudo inverse used in _mel_to_linear_scale, the solution
+    never contains negative magnitudes.
+
+    Args:
+        mel_magnitude_in: The mel scale magnitude spectrum. Expected shape
+            is [-1, time, frequency].
+        n_stft_bins: The number of stft bins.
+        mel_lower_hertz_edge: The lowest frequency in hertz to include in the
+            mel spectrum
+        mel_upper_hertz_edge: The highest frequency in hertz to include in the
+            mel spectrum
+
+    Returns:
+        The mel_magnitude_in transformed to the linear domain. Shape is
+        mel_magnitude_in.shape, except shape[-1] = n_stft_bins.
+    """
+
+    mel_magnitude_in = np.asarray(mel_magnitude_in)
+    n_mel_bins = mel_magnitude_in.shape[-1]
+    linear_to_mel_weight_matrix = _get_mel_matrix(
+        n_mel_bins, n_stft_bins, mel_lower_hertz_edge, mel_upper_hertz_edge
+    ).numpy()
+
+    mel_frames = np.reshape(mel_magnitude_in, [-1, n_mel_bins])
+    linear_frames = nnls(linear_to_mel_weight_matrix.T, mel_frames.T).T
+
+    return np.reshape(
+        linear_frames, mel_magnitude_in.shape[:-1] + (n_stft_bins,)
+    ).astype(mel_magnitude_in.dtype)
+
+def _unwrap(phase):
+    """Unwraps a phase signal along its last axis.
+
+    A TensorFlow equivalent of np.unwrap, so the phase can be unwrapped
+    inside a graph.
+
+    Args:
+        phase: The wrapped phase, in radians.
+
+    Returns:
+        The unwrapped phase, jumps larger than pi between consecutive
+        elements are replaced by their 2*pi complement. Shape is
+        phase.shape.
+    """
+
+    diff = phase[..., 1:] - phase[..., 0:-1]
+    diff_mod = tf.math.floormod(diff + np.pi, 2 * np.pi) - np.pi
+    diff_mod = tf.where((diff_mod == -np.pi) & (diff > 0), -diff_mod, diff_mod)
+
+    correction = tf.where(
+        tf.abs(diff) < np.pi, tf.zeros_like(diff), diff_mod - diff
+    )
+    correction = tf.cumsum(correction, axis=-1)
+
+    return tf.concat([phase[..., 0:1], phase[..., 1:] + correction], axis=-1)
+
+def _pghi(magnitude, frame_length, frame_step, tolerance=1e-5):
+    """Estimates the phase of a magnitude spectrum by phase gradient heap
+    integration (PGHI).
+
+    Implements the non-iterative method from Prusa et al., 'A Noniterative
+    Method for Reconstruction of Phase From STFT Magnitude'. The phase
+    derivatives are estimated from the log-magnitude gradients, treating
+    the analysis window as a Gaussian, and integrated outwards from the
+    loudest bins.
+
+    Args:
+        magnitude: The linear magnitude spectrum of a single signal, without
+            the nyquist frequency. Expected shape is [time, frequencies].
+        frame_length: The length of each frame.
+        frame_step: Time increment after each frame, i.e.
+            overlap=frame_length - frame_step.
+        tolerance: Bins quieter than tolerance times the loudest bin are
+            not integrated and are left with zero phase.
+
+    Returns:
+        The estimated phase, in the frame referenced convention of
+        tf.signal.stft. Shape is magnitude.shape.
+    """
+
+    n_frames, n_bins = magnitude.shape
+    gamma = _HAMMING_GAMMA * frame_length ** 2
+    log_magnitude = np.log(np.maximum(magnitude, _EPSILON))
+
+    # Phase change from one frame to the next, and from one frequency
+    # bin to the next, relative to the window centre.
+    d_log_d_time = np.gradient(log_magnitude, axis=0) / frame_step
+    d_log_d_freq = np.gradient(log_magnitude, axis=1) * frame_length
+    bin_frequency = 2 * np.pi * np.arange(n_bins) / frame_length
+    time_step = frame_step * (d_log_d_freq / gamma + bin_frequency)
+    freq_step = -gamma / frame_length * d_log_d_time
+
+    done = (log_magnitude < np.max(log_magnitude) + np.log(tolerance)).tolist()
+    order = np.argsort(log_magnitude, axis=None)[::-1].tolist()
+
+    # The integration visits bins one at a time, nested lists are much
+    # faster to index from Python than arrays.
+    phase = np.zeros([n_frames, n_bins]).tolist()
+    log_magnitude = log_magnitude.tolist()
+    time_step = time_step.tolist()
+    freq_step = freq_step.tolist()
+
+    for index in order:
+        n, k = divmod(index, n_bins)
+        if done[n][k]:
+            continue
+
+        # Start a new region from the loudest bin not yet reached.
+        done[n][k] = True
+        heap = [(-log_magnitude[n][k], n, k)]
+        while heap:
+            _, n, k = heapq.heappop(heap)
+            for d_n, d_k in ((1, 0), (-1, 0), (0, 1), (0, -1)):
+                m, j = n + d_n, k + d_k
+                if 0 <= m < n_frames and 0 <= j < n_bins and not done[m][j]:
+                    step = time_step if d_k == 0 else freq_step
+                    phase[m][j] = phase[n][k] + (d_n + d_k) * (
+                        step[n][k] + step[m][j]) / 2
+                    done[m][j] = True
+                    heapq.heappush(heap, (-log_magnitude[m][j], m, j))
+
+    # Reference the phase to the start of each frame instead of the
+    # window centre, which is half a frame later.
+    return np.array(phase) + np.pi * np.arange(n_bins)
+
+def _stft(waveform, frame_length, frame_step, pad_end=True):
+    """Computes the STFT of a batch of waveforms, without the nyquist
+    frequency.
+
+    Equivalent to tf.signal.stft, written out as framing and a real FFT.
+    As in tf.signal.stft, frames are zero padded to a power of two before
+    the FFT.
+
+    Args:
+        waveform: The waveforms to be transformed. Expected shape is
+            [batch, time].
+        frame_length: The length of each stft frame.
+        frame_step: Time increment after each frame, i.e.
+            overlap=frame_length - frame_step.
+        pad_end: If true, the end of the signal is zero padded so every
+            sample is covered by a frame.
+
+    Returns:
+        The complex STFT. Shape is [batch, time_bins, fft_length // 2],
+        where fft_length is frame_length rounded up to a power of two.
+    """
+
+    frames = tf.signal.frame(waveform, frame_length, frame_step, pad_end=pad_end)
+    frames = frames * _get_window(frame_length, frames.dtype)
+    stft = tf.signal.rfft(frames, fft_length=[_get_fft_length(frame_length)])
+
+    # Truncate the nyquist frequency, commonly done in other papers,
+    # also makes computation easier.
+    return stft[:, :, 0:-1]
+
+def _inverse_stft(stft, frame_length, frame_step):
+    """Inverts a complex STFT with a real inverse FFT and overlap-add.
+
+    Equivalent to tf.signal.inverse_stft with the inverse of WINDOW_FN.
+
+    Args:
+        stft: The complex STFT to be inverted, without the nyquist
+            frequency. Expected shape is [batch, time_bins, fft_length // 2],
+            where fft_length is frame_length rounded up to a power of two.
+        frame_length: The length of each stft frame.
+        frame_step: Time increment after each frame, i.e.
+            overlap=frame_length - frame_step.
+
+    Returns:
+        The waveforms. Shape is [batch, signal_length].
+    """
+
+    # Set the nyquist frequency to zero (the band we earlier removed).
+    # This is also commonly done in these other papers.
+    nyquist = tf.zeros(tf.concat([tf.shape(stft)[:-1], [1]], 0), stft.dtype)
+    stft = tf.concat([stft, nyquist], axis=-1)
+
+    # Frames are zero padded to fft_length by _stft, so the padding is
+    # truncated before the synthesis window is applied.
+    frames = tf.signal.irfft(stft, fft_length=[_get_fft_length(frame_length)])
+    frames = frames[..., :frame_length]
+    frames = frames * _get_inv_window(frame_length, frame_step, frames.dtype)
+    return tf.signal.overlap_and_add(frames, frame_step)
+
+def _stft_core(waveform, frame_length, frame_step):
+    """Computes the real and imaginary parts of the STFT of a batch of
+    waveforms, the shared first stage of every forward transform.
+
+    Args:
+        waveform: The waveforms to be transformed. Expected shape is
+            [batch, time].
+        frame_length: The length of each stft frame.
+        frame_step: Time increment after each frame, i.e.
+            overlap=frame_length - frame_step.
+
+    Returns:
+        A tuple (real, img) of the STFT components, without the nyquist
+        frequency. Each has shape [batch, time_bins, fft_length // 2],
+        see _stft.
+    """
+
+    stft = _stft(waveform, frame_length, frame_step)
+    return tf.math.real(stft), tf.math.imag(stft)
+
+def _stft_to_magnitude(real, img, log_magnitude, n_mel_bins,
+                       mel_lower_hertz_edge, mel_upper_hertz_edge,
+                       dtype=tf.float32):
+    """Computes the (log-)magnitude spectrum from the STFT components.
+
+    Args:
+        real: The real part of the STFT, shape [batch, time, frequency].
+        img: The imaginary part of the STFT, shape [batch, time, frequency].
+        log_magnitude: If true, the log-magnitude will be returned.
+        n_mel_bins: If specified, a magnitude spectrum in the mel scale
+            will be returned.
+        mel_lower_hertz_edge: The minimum frequency to be included in the
+            mel-spectogram
+        mel_upper_hertz_edge: The highest frequency to be included in the
+            mel-spectogram
+        dtype: The dtype of the returned magnitude spectrum. With
+            tf.bfloat16 the mel projection is also computed in bfloat16,
+            otherwise the magnitude is computed in float32 and cast at
+            the end.
+
+    Returns:
+        The magnitude spectrum. Shape is [batch, time, frequency], or
+        [batch, time, n_mel_bins] if n_mel_bins is given.
+    """
+
+    # The epsilon keeps the gradient finite for silent bins. The magnitude
+    # is computed in float32, as the epsilon underflows in float16.
+    magnitude = tf.math.sqrt(real * real + img * img + _EPSILON ** 2)
+
+    # Only bfloat16 has the exponent range for the gradient of the log
+    # near silent bins, float16 overflows.
+    if dtype == tf.bfloat16:
+        magnitude = tf.cast(magnitude, dtype)
+
+    if n_mel_bins:
+        magnitude = _linear_to_mel_scale(
+            magnitude, n_mel_bins, mel_lower_hertz_edge, mel_upper_hertz_edge
+        )
+
+    if log_magnitude:
+        magnitude = tf.math.log(tf.cast(magnitude, tf.float32) + _EPSILON)
+
+    return tf.cast(magnitude, dtype)
+
+def _stft_to_phase(real, img, instantaneous_frequency, n_mel_bins,
+                   mel_lower_hertz_edge, mel_upper_hertz_edge):
+    """Computes the phase, or instantaneous frequency, from the STFT
+    components.
+
+    Args:
+        real: The real part of the STFT, shape [batch, time, frequency].
+        img: The imaginary part of the STFT, shape [batch, time, frequency].
+        instantaneous_frequency: If true, the instantaneous frequency will,
+            be returned instead of phase.
+        n_mel_bins: If specified, the phase is projected onto the mel scale.
+        mel_lower_hertz_edge: The minimum frequency to be included in the
+            mel-spectogram
+        mel_upper_hertz_edge: The highest frequency to be included in the
+            mel-spectogram
+
+    Returns:
+        The phase representation. Shape is [batch, time, frequency], or
+        [batch, time, n_mel_bins] if n_mel_bins is given.
+    """
+
+    # Silent bins have no defined phase, they are given phase zero (as
+    # tf.math.angle does) and a finite gradient.
+    silent = tf.equal(real * real + img * img, 0.0)
+    phase = tf.math.atan2(img, tf.where(silent, tf.ones_like(real), real))
+
+    if n_mel_bins:
+        phase = _linear_to_mel_scale(
+            phase, n_mel_bins, mel_lower_hertz_edge, mel_upper_hertz_edge
+        )
+
+    if instantaneous_frequency:
+        phase = _unwrap(phase)
+        phase = tf.concat([phase[:, 0:1, :],
+                           phase[:, 1:, :] - phase[:, 0:-1, :]], axis=-2)
+
+    return phase
+
+def _polar(magnitude, phase):
+    """Builds a complex tensor from its magnitude and phase.
+
+    Evaluates magnitude * exp(i * phase) through its real and imaginary
+    parts, which is considerably cheaper than a complex exp and multiply.
+
+    Args:
+        magnitude: The magnitude, broadcastable to phase.
+        phase: The phase, in radians.
+
+    Returns:
+        The complex tensor. Shape is phase.shape.
+    """
+
+    return tf.complex(magnitude * tf.math.cos(phase),
+                      magnitude * tf.math.sin(phase))
+
+@tf.function(reduce_retracing=True)
+def _griffin_lim(magnitude, n_iter, frame_length, frame_step, momentum=0.99):
+    """Estimates the phase of a batch of magnitude spectra with Griffin-Lim.
+
+    Uses the momentum ('fast') variant of the algorythm, as librosa does,
+    with every iteration running on the whole batch.
+
+    Args:
+        magnitude: The linear magnitude spectra, without the nyquist
+            frequency. Expected shape is [batch, time, frequencies].
+        n_iter: number of Griffin-Lim iterations to run.
+        frame_length: The length of each frame.
+        frame_step: Time increment after each frame, i.e.
+            overlap=frame_length - frame_step.
+        momentum: The momentum applied to the phase updates.
+
+    Returns:
+        The waveforms synthesised from magnitude and the estimated
+        phase. Shape is [batch, signal_length].
+    """
+
+    magnitude = tf.cast(magnitude, tf.complex64)
+    random_phase = tf.random.uniform(tf.shape(magnitude), maxval=2 * np.pi)
+    angles = _polar(1.0, random_phase)
+
+    def iteration(angles, rebuilt):
+        previous = rebuilt
+        waveform = _inverse_stft(magnitude * angles, frame_length, frame_step)
+        rebuilt = _stft(waveform, frame_length, frame_step, pad_end=False)
+        angles = rebuilt - (momentum / (1 + momentum)) * previous
+        angles = angles / tf.cast(tf.abs(angles) + 1e-16, tf.complex64)
+        return angles, rebuilt
+
+    angles, _ = tf.while_loop(
+        lambda angles, rebuilt: True, iteration,
+        [angles, tf.zeros_like(angles)], maximum_iterations=n_iter
+    )
+
+    return _inverse_stft(magnitude * angles, frame_length, frame_step)
+
 def waveform_2_stft(waveform, frame_length=512, frame_step=128, n_mel_bins=None,
                     mel_lower_hertz_edge=0.0, mel_upper_hertz_edge=8000.0):
     """Transforms a Waveform into the STFT domain.
@@ -103,15 +531,17 @@ def waveform_2_stft(waveform, frame_length=512, frame_step=128, n_mel_bins=None,
     if len(waveform.shape) == 1:
         waveform = tf.expand_dims(waveform, 0)
 
-    stft = tf.signal.stft(
-        waveform, frame_length=frame_length, frame_step=frame_step,
-        pad_end=True, window_fn=WINDOW_FN
+    return _waveform_2_stft(
+        waveform, frame_length, frame_step, n_mel_bins,
+        mel_lower_hertz_edge, mel_upper_hertz_edge
     )
 
-    # Truncate the nyquist frequency, commonly done in other papers,
-    # also makes computation easier.
-    real = tf.math.real(stft)[:, :, 0:-1]
-    img = tf.math.imag(stft)[:, :, 0:-1]
+@tf.function(reduce_retracing=True)
+def _waveform_2_stft(waveform, frame_length, frame_step, n_mel_bins,
+                     mel_lower_hertz_edge, mel_upper_hertz_edge):
+    """Graph compiled body of waveform_2_stft, expects [batch, time]."""
+
+    real, img = _stft_core(waveform, frame_length, frame_step)
 
     if n_mel_bins:
         real = _linear_to_mel_scale(
@@ -148,8 +578,16 @@ def stft_2_waveform(stft, frame_length=512, frame_step=128, n_mel_bins=None,
     if len(stft.shape) == 3:
         stft = tf.expand_dims(stft, 0)
 
-    # Set the nyquist frequency to zero (the band we earlier removed).
-    # This is also commonly done in these other papers.
+    return _stft_2_waveform(
+        stft, frame_length, frame_step, n_mel_bins,
+        mel_lower_hertz_edge, mel_upper_hertz_edge
+    )
+
+@tf.function(reduce_retracing=True)
+def _stft_2_waveform(stft, frame_length, frame_step, n_mel_bins,
+                     mel_lower_hertz_edge, mel_upper_hertz_edge):
+    """Graph compiled body of stft_2_waveform, expects [batch, time, frequency, 2]."""
+
     real = stft[:, :, :, 0]
     img = stft[:, :, :, 1]
 
@@ -161,20 +599,13 @@ def stft_2_waveform(stft, frame_length=512, frame_step=128, n_mel_bins=None,
             img, frame_length//2, mel_lower_hertz_edge, mel_upper_hertz_edge
         )
 
-    real = tf.pad(real, [[0, 0], [0, 0], [0, 1]], constant_values=0)
-    img = tf.pad(img, [[0, 0], [0, 0], [0, 1]], constant_values=0)
-
     stft = tf.complex(real, img)
-    inv_window_fn = tf.signal.inverse_stft_window_fn(frame_step, forward_window_fn=WINDOW_FN)
-    waveform = tf.signal.inverse_stft(
-        stft, frame_length=frame_length, frame_step=frame_step, window_fn=inv_window_fn
-    )
-    return waveform
+    return _inverse_stft(stft, frame_length, frame_step)
 
 def waveform_2_spectogram(waveform, frame_length=512, frame_step=128,
                           log_magnitude=True, instantaneous_frequency=True,
                           n_mel_bins=None, mel_lower_hertz_edge=0.0,
-                          mel_upper_hertz_edge=8000.0):
+                          mel_upper_hertz_edge=8000.0, dtype=tf.float32):
     """Transforms a Waveform to a Spectogram.
 
     Returns the spectrogram for the given input. Note, this function
@@ -196,6 +627,10 @@ def waveform_2_spectogram(waveform, frame_length=512, frame_step=128,
             mel-spectogram
         mel_upper_hertz_edge: The highest frequency to be included in the
             mel-spectogram
+        dtype: The dtype of the returned spectogram. With tf.bfloat16
+            the mel projection of the magnitude is also computed in
+            bfloat16, halving its memory traffic. The FFT, magnitude,
+            phase and log are always computed in float32.
 
     Returns:
         A spectogram representation of the input waveform. Shape
@@ -205,44 +640,41 @@ def waveform_2_spectogram(waveform, frame_length=512, frame_step=128,
     if len(waveform.shape) == 1:
         waveform = tf.expand_dims(waveform, 0)
 
-    stft = tf.signal.stft(
-        waveform, frame_length=frame_length, frame_step=frame_step,
-        pad_end=True, window_fn=WINDOW_FN
+    return _waveform_2_spectogram(
+        waveform, frame_length, frame_step, log_magnitude,
+        instantaneous_frequency, n_mel_bins, mel_lower_hertz_edge,
+        mel_upper_hertz_edge, dtype
     )
 
-    # Truncate the nyquist frequency, commonly done in other papers,
-    # also makes computation easier.
-    magnitude = tf.abs(stft)[:, :, 0:-1]
-    phase = tf.math.angle(stft)[:, :, 0:-1]
+@tf.function(reduce_retracing=True)
+def _waveform_2_spectogram(waveform, frame_length, frame_step, log_magnitude,
+                           instantaneous_frequency, n_mel_bins,
+                           mel_lower_hertz_edge, mel_upper_hertz_edge, dtype):
+    """Graph compiled body of waveform_2_spectogram, expects [batch, time]."""
 
-    if n_mel_bins:
-        magnitude = _linear_to_mel_scale(
-            magnitude, n_mel_bins, mel_lower_hertz_edge, mel_upper_hertz_edge
-        )
-        phase = _linear_to_mel_scale(
-            phase, n_mel_bins, mel_lower_hertz_edge, mel_upper_hertz_edge
-        )
-
-    if log_magnitude:
-        magnitude = tf.math.log(magnitude + _EPSILON)
+    real, img = _stft_core(waveform, frame_length, frame_step)
 
-    if instantaneous_frequency:
-        phase = np.unwrap(phase)
-        phase = np.concatenate([np.expand_dims(phase[:, 0, :], axis=-2),
-                                np.diff(phase, axis=-2)], axis=-2).astype(np.float32)
+    magnitude = _stft_to_magnitude(
+        real, img, log_magnitude, n_mel_bins, mel_lower_hertz_edge,
+        mel_upper_hertz_edge, dtype
+    )
+    phase = _stft_to_phase(
+        real, img, instantaneous_frequency, n_mel_bins, mel_lower_hertz_edge,
+        mel_upper_hertz_edge
+    )
 
     spectogram = tf.concat([tf.expand_dims(magnitude, 3),
-                            tf.expand_dims(phase, 3)], axis=-1)
+                            tf.expand_dims(tf.cast(phase, dtype), 3)], axis=-1)
 
     return spectogram
 
 def waveform_2_magnitude(waveform, frame_length=512, frame_step=128, log_magnitude=True,
                          n_mel_bins=None, mel_lower_hertz_edge=0.0,
-                         mel_upper_hertz_edge=8000.0):
+                         mel_upper_hertz_edge=8000.0, dtype=tf.float32):
     """Transform a Waveform to a Magnitude Spectrum.
 
-    This function is a wrapper for waveform_2_spectogram and removes
-    the phase component.
+    Equivalent to the magnitude channel of waveform_2_spectogram, without
+    computing the phase component.
 
     Args:
         waveform: the signal to be transformed. Expected shape
@@ -257,29 +689,43 @@ def waveform_2_magnitude(waveform, frame_length=512, frame_step=128, log_magnitu
             mel-spectogram
         mel_upper_hertz_edge: The highest frequency to be included in the
             mel-spectogram
+        dtype: The dtype of the returned magnitude spectrum, see
+            waveform_2_spectogram.
 
     Returns:
         A magnitude spectrum representation of the input waveform. Shape
         is [-1, time_bins, frequency]
     """
 
-    spectogram = waveform_2_spectogram(
-        waveform, frame_length=frame_length, frame_step=frame_step,
-        log_magnitude=log_magnitude, n_mel_bins=n_mel_bins,
-        mel_lower_hertz_edge=mel_lower_hertz_edge,
-        mel_upper_hertz_edge=mel_upper_hertz_edge
+    if len(waveform.shape) == 1:
+        waveform = tf.expand_dims(waveform, 0)
+
+    return _waveform_2_magnitude(
+        waveform, frame_length, frame_step, log_magnitude, n_mel_bins,
+        mel_lower_hertz_edge, mel_upper_hertz_edge, dtype
     )
 
-    magnitude = spectogram[:, :, :, 0]
-    return magnitude
+@tf.function(reduce_retracing=True)
+def _waveform_2_magnitude(waveform, frame_length, frame_step, log_magnitude,
+                          n_mel_bins, mel_lower_hertz_edge,
+                          mel_upper_hertz_edge, dtype):
+    """Graph compiled body of waveform_2_magnitude, expects [batch, time]."""
+
+    real, img = _stft_core(waveform, frame_length, frame_step)
+    return _stft_to_magnitude(
+        real, img, log_magnitude, n_mel_bins, mel_lower_hertz_edge,
+        mel_upper_hertz_edge, dtype
+    )
 
 def magnitude_2_waveform(magnitude, n_iter=16, frame_length=512,
                          frame_step=128, log_magnitude=True,
                          n_mel_bins=None, mel_lower_hertz_edge=0.0,
-                         mel_upper_hertz_edge=8000.0):
+                         mel_upper_hertz_edge=8000.0, method='gla',
+                         max_workers=1):
     """Transform a Magnitude Spectrum to a Waveform.
 
-    Uses the Griffin-Lim algorythm, via the librosa implementation.
+    Uses the Griffin-Lim algorythm, via the librosa implementation or
+    batched in TensorFlow, or phase gradient heap integration.
 
     Args:
         magnitude: the magnitude spectrum to be transformed. Expected
@@ -295,34 +741,81 @@ def magnitude_2_waveform(magnitude, n_iter=16, frame_length=512,
             mel-spectogram
         mel_upper_hertz_edge: The highest frequency to be included in the
             mel-spectogram
+        method: How the phase is estimated, 'gla' for Griffin-Lim,
+            'tf_gla' for Griffin-Lim run on the whole batch in TensorFlow
+            (for example on a GPU) or 'pghi' for the non-iterative phase
+            gradient heap integration.
+        max_workers: The number of threads used to run librosa's
+            Griffin-Lim on the batch items, only used when method is
+            'gla'. The default runs them serially.
 
     Returns:
         A waveform representation of the input magnitude spectrum
-        where the phase has been estimated using Griffin-Lim. Shape is
-        [-1, signal_length]
+        where the phase has been estimated using the given method.
+        Shape is [-1, signal_length]
     """
 
+    if method not in ('gla', 'tf_gla', 'pghi'):
+        raise ValueError('Unknown phase reconstruction method: %s' % method)
+
+    # Work on a private copy, so the conversions below can be in place.
+    magnitude = np.array(magnitude)
     if len(magnitude.shape) == 2:
-        magnitude = tf.expand_dims(magnitude, 0)
+        magnitude = np.expand_dims(magnitude, 0)
 
     if log_magnitude:
-        magnitude = np.exp(magnitude) - _EPSILON
+        np.exp(magnitude, out=magnitude)
+        magnitude -= _EPSILON
 
     if n_mel_bins:
-        magnitude = _mel_to_linear_scale(
+        magnitude = _mel_to_linear_magnitude(
             magnitude, frame_length//2, mel_lower_hertz_edge, mel_upper_hertz_edge
         )
 
-    # Set the nyquist frequency to zero (the band we earlier removed).
-    # This is also commonly done in these other papers.
-    magnitude = np.pad(magnitude, [[0, 0], [0, 0], [0, 1]])
+    if method == 'tf_gla':
+        return _griffin_lim(
+            tf.cast(magnitude, tf.float32), n_iter, frame_length, frame_step
+        ).numpy()
+
+    if method == 'pghi':
+        phase = np.array([
+            _pghi(m, frame_length, frame_step) for m in magnitude
+        ])
+        stft = np.stack([magnitude * np.cos(phase),
+                         magnitude * np.sin(phase)], axis=-1)
+        return stft_2_waveform(
+            stft.astype(np.float32), frame_length, frame_step
+        ).numpy()
+
+    # Librosa expects [frequencies, time]. Transposing into a zeroed buffer
+    # one bin larger also sets the nyquist frequency to zero (the band we
+    # earlier removed), as is commonly done in these other papers.
+    n_batch, n_frames, n_bins = magnitude.shape
+    spectrum = np.zeros([n_batch, n_bins + 1, n_frames], dtype=magnitude.dtype)
+    spectrum[:, 0:n_bins, :] = np.transpose(magnitude, [0, 2, 1])
+
+    # Passing the length lets librosa synthesise straight into the
+    # expected size instead of trimming or padding its output.
+    signal_length = (n_frames - 1) * frame_step + frame_length
+    waveform = np.empty([n_batch, signal_length], dtype=magnitude.dtype)
+
+    def to_waveform(i):
+        waveform[i] = griffinlim(
+            spectrum[i], n_iter=n_iter, win_length=frame_length,
+            hop_length=frame_step, pad_mode='constant', center=False,
+            length=signal_length
+        )
 
-    to_waveform = lambda m: griffinlim(
-        np.transpose(m), n_iter=n_iter, win_length=frame_length,
-        hop_length=frame_step, pad_mode='constant', center=False
-    )
+    # Griffin-Lim is dominated by NumPy FFTs, which release the GIL, so
+    # on a multi-core machine batch items can be reconstructed from threads.
+    if max_workers > 1:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(to_waveform, range(n_batch)))
+    else:
+        for i in range(n_batch):
+            to_waveform(i)
 
-    return np.array(list(map(to_waveform, magnitude)))
+    return waveform
 
 def spectogram_2_waveform(spectogram, frame_length=512, frame_step=128,
                           log_magnitude=True, instantaneous_frequency=True,
@@ -354,6 +847,20 @@ def spectogram_2_waveform(spectogram, frame_length=512, frame_step=128,
     if len(spectogram.shape) == 3:
         spectogram = tf.expand_dims(spectogram, 0)
 
+    return _spectogram_2_waveform(
+        spectogram, frame_length, frame_step, log_magnitude,
+        instantaneous_frequency, n_mel_bins, mel_lower_hertz_edge,
+        mel_upper_hertz_edge
+    )
+
+@tf.function(reduce_retracing=True)
+def _spectogram_2_waveform(spectogram, frame_length, frame_step, log_magnitude,
+                           instantaneous_frequency, n_mel_bins,
+                           mel_lower_hertz_edge, mel_upper_hertz_edge):
+    """Graph compiled body of spectogram_2_waveform, expects
+    [batch, time, frequency, 2].
+    """
+
     magnitude = spectogram[:, :, :, 0]
     phase = spectogram[:, :, :, 1]
 
@@ -369,21 +876,9 @@ def spectogram_2_waveform(spectogram, frame_length=512, frame_step=128,
         magnitude = tf.math.exp(magnitude) - _EPSILON
 
     if instantaneous_frequency:
-        phase = tf.cumsum(phase, axis=-2)
-        phase = (phase + np.pi) % (2 * np.pi) - np.pi
+        phase = tf.math.floormod(
+            tf.cumsum(phase, axis=-2) + np.pi, 2 * np.pi
+        ) - np.pi
 
-    # Set the nyquist frequency to zero (the band we earlier removed).
-    # This is also commonly done in these other papers.
-    magnitude = tf.pad(magnitude, [[0, 0], [0, 0], [0, 1]], constant_values=0)
-    phase = tf.pad(phase, [[0, 0], [0, 0], [0, 1]], constant_values=0)
-
-    real = magnitude * tf.math.cos(phase)
-    img = magnitude * tf.math.sin(phase)
-
-    stft = tf.complex(real, img)
-    inv_window_fn = tf.signal.inverse_stft_window_fn(frame_step, forward_window_fn=WINDOW_FN)
-    waveform = tf.signal.inverse_stft(
-        stft, frame_length=frame_length,
-        frame_step=frame_step, window_fn=inv_window_fn
-    )
-    return waveform
+    stft = _polar(magnitude, phase)
+    return _inverse_stft(stft, frame_length, frame_step)
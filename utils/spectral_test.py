@@ -50,6 +50,37 @@ class SpectralTest(tf.test.TestCase):
 
         self.assertEqual((128, 80, 2), spectogram.shape)
 
+    def test_waveform_to_stft_matches_tf_signal(self):
+        # A frame length that is not a power of two, so the frames
+        # are zero padded before the FFT.
+        waveform = np.random.normal(size=(1, 2**14)).astype(np.float32)
+        stft = spectral.waveform_2_stft(
+            waveform, frame_length=400, frame_step=100
+        )
+        expected = tf.signal.stft(
+            waveform, frame_length=400, frame_step=100, pad_end=True,
+            window_fn=spectral.WINDOW_FN
+        )[:, :, 0:-1]
+
+        self.assertEqual((1, 164, 256, 2), stft.shape)
+        self.assertAllClose(tf.math.real(expected), stft[..., 0], rtol=1e-3, atol=1e-3)
+        self.assertAllClose(tf.math.imag(expected), stft[..., 1], rtol=1e-3, atol=1e-3)
+
+    def test_stft_to_waveform_matches_tf_signal(self):
+        stft = np.random.normal(size=(1, 64, 256, 2)).astype(np.float32)
+        waveform = spectral.stft_2_waveform(stft, frame_length=400, frame_step=100)
+
+        nyquist = np.zeros((1, 64, 1), dtype=np.complex64)
+        expected = tf.signal.inverse_stft(
+            np.concatenate([stft[..., 0] + 1j * stft[..., 1], nyquist], axis=-1),
+            frame_length=400, frame_step=100,
+            window_fn=tf.signal.inverse_stft_window_fn(
+                100, forward_window_fn=spectral.WINDOW_FN
+            )
+        )
+
+        self.assertAllClose(expected, waveform, rtol=1e-3, atol=1e-3)
+
     def test_waveform_to_spectogram_shape(self):
         waveform = np.random.normal(size=(2**14,)).astype(np.float32)
         spectogram = spectral.waveform_2_spectogram(
@@ -82,6 +113,55 @@ class SpectralTest(tf.test.TestCase):
 
         self.assertEqual((128, 80), magnitude.shape)
 
+    def test_waveform_to_bfloat16_magnitude(self):
+        magnitude = spectral.waveform_2_magnitude(
+            self.waveform, frame_length=512, frame_step=128, n_mel_bins=80
+        )
+        magnitude_bf16 = spectral.waveform_2_magnitude(
+            self.waveform, frame_length=512, frame_step=128, n_mel_bins=80,
+            dtype=tf.bfloat16
+        )
+
+        self.assertEqual(tf.bfloat16, magnitude_bf16.dtype)
+        self.assertAllClose(
+            magnitude, tf.cast(magnitude_bf16, tf.float32), rtol=0.05, atol=0.05
+        )
+
+    def test_waveform_to_float16_magnitude_silent_gradient(self):
+        waveform = tf.Variable(np.concatenate([
+            np.zeros(2**13), np.random.normal(size=(2**13,))
+        ]).astype(np.float32))
+
+        with tf.GradientTape() as tape:
+            magnitude = spectral.waveform_2_magnitude(
+                waveform, frame_length=512, frame_step=128, n_mel_bins=80,
+                dtype=tf.float16
+            )
+            loss = tf.reduce_sum(tf.cast(magnitude, tf.float32))
+
+        self.assertEqual(tf.float16, magnitude.dtype)
+        self.assertAllEqual(tf.math.is_finite(magnitude), tf.ones_like(magnitude, tf.bool))
+        self.assertAllEqual(
+            tf.math.is_finite(tape.gradient(loss, waveform)),
+            tf.ones(waveform.shape, tf.bool)
+        )
+
+    def test_magnitude_to_waveform_tf_gla_shape(self):
+        magnitude = np.random.normal(size=(2, 128, 256)).astype(np.float32)
+        waveform = spectral.magnitude_2_waveform(
+            magnitude, n_iter=2, frame_length=512, frame_step=128, method='tf_gla'
+        )
+
+        self.assertEqual((2, 127 * 128 + 512), waveform.shape)
+
+    def test_magnitude_to_waveform_threaded_shape(self):
+        magnitude = np.random.normal(size=(2, 128, 256)).astype(np.float32)
+        waveform = spectral.magnitude_2_waveform(
+            magnitude, n_iter=2, frame_length=512, frame_step=128, max_workers=2
+        )
+
+        self.assertEqual((2, 127 * 128 + 512), waveform.shape)
+
     def test_waveform_to_spectogram_return(self):
         spectogram = spectral.waveform_2_spectogram(
             self.waveform, frame_length=512, frame_step=128
@@ -138,6 +218,20 @@ class SpectralTest(tf.test.TestCase):
         pesq = perceptual_helper.pesq_metric(self.waveform, waveform_hat)
         self.assertTrue(pesq > 3.8)
 
+    def test_waveform_to_magnitude_pghi_return(self):
+        spectogram = spectral.waveform_2_magnitude(
+            self.waveform, frame_length=512, frame_step=128
+        )
+        waveform_hat = spectral.magnitude_2_waveform(
+            spectogram, frame_length=512, frame_step=128, method='pghi'
+        )[0]
+
+        # Account for extra samples from reverse transform
+        waveform_hat = waveform_hat[0:len(self.waveform)]
+
+        pesq = perceptual_helper.pesq_metric(self.waveform, waveform_hat)
+        self.assertTrue(pesq > 3.8)
+
 if __name__ == '__main__':
     os.environ["CUDA_VISIBLE_DEVICES"] = ''
     tf.test.main()
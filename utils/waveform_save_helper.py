@@ -17,14 +17,22 @@ waveforms.
 """
 
 import os
+from concurrent.futures import ThreadPoolExecutor
 import soundfile as sf
 import numpy as np
 from audio_synthesis.datasets import waveform_dataset
 from audio_synthesis.utils import spectral
 
+# Examples are converted and written on a single background thread, so
+# training can continue while they are saved, and saves stay in order.
+_SAVE_EXECUTOR = ThreadPoolExecutor(max_workers=1)
+
 def save_wav_data(epoch, real, generated, sampling_rate, result_dir, get_waveform):
     """Saves a batch of real and generated data.
 
+    The examples in each batch are concatenated into a single
+    audio file. Saving happens on a background thread.
+
     Args:
         epoch: The number of training epochs when the generated
             data was produced.
@@ -35,13 +43,24 @@ def save_wav_data(epoch, real, generated, sampling_rate, result_dir, get_wavefor
             audio.
         get_waveform: A function that transforms the given audio representation
             into a waveform.
+
+    Returns:
+        A concurrent.futures.Future that completes once the
+        data is saved. Calling result() re-raises any exception
+        raised while saving.
+    """
+
+    return _SAVE_EXECUTOR.submit(
+        _write_wav_data, epoch, real, generated, sampling_rate, result_dir, get_waveform
+    )
+
+def _write_wav_data(epoch, real, generated, sampling_rate, result_dir, get_waveform):
+    """Converts a batch of real and generated data to waveforms
+    and writes them to disk. See save_wav_data.
     """
 
-    gen_waveforms = []
-    real_waveforms = []
-    for real_representation, generated_representation in zip(real, generated):
-        real_waveforms.extend(get_waveform(real_representation))
-        gen_waveforms.extend(get_waveform(generated_representation))
+    real_waveforms = np.concatenate([get_waveform(x) for x in real])
+    gen_waveforms = np.concatenate([get_waveform(x) for x in generated])
 
     sf.write(os.path.join(result_dir, 'real_{}.wav'.format(epoch)), real_waveforms, sampling_rate)
     sf.write(os.path.join(result_dir, 'gen_{}.wav'.format(epoch)), gen_waveforms, sampling_rate)